@@ -0,0 +1,32 @@
+"""add review keyset pagination index
+
+Revision ID: 5d1e7a0c9b42
+Revises: ce3679ce8e82
+Create Date: 2026-10-17 10:02:11.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1e7a0c9b42'
+down_revision: Union[str, None] = 'ce3679ce8e82'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves "reviews for movie X ordered by (created_at, id) desc" as an index range scan
+    op.create_index(
+        'idx_review_movie_created_id',
+        'reviews',
+        ['movie_id', 'created_at', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_review_movie_created_id', table_name='reviews')
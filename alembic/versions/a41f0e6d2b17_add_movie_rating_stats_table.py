@@ -0,0 +1,51 @@
+"""add movie_rating_stats table
+
+Revision ID: a41f0e6d2b17
+Revises: 5d1e7a0c9b42
+Create Date: 2026-10-17 11:24:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f0e6d2b17'
+down_revision: Union[str, None] = '5d1e7a0c9b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'movie_rating_stats',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('review_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('rating_sum', sa.Float(), nullable=False, server_default='0'),
+        *[
+            sa.Column(f'hist_{i}', sa.Integer(), nullable=False, server_default='0')
+            for i in range(11)
+        ],
+        sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('movie_id')
+    )
+
+    # Backfill from existing reviews; afterwards the API keeps it current
+    buckets = ", ".join(
+        f"COUNT(*) FILTER (WHERE rating >= {i} AND rating < {i + 1})" if i < 10
+        else "COUNT(*) FILTER (WHERE rating >= 10)"
+        for i in range(11)
+    )
+    columns = ", ".join(f"hist_{i}" for i in range(11))
+    op.execute(f"""
+        INSERT INTO movie_rating_stats (movie_id, review_count, rating_sum, {columns})
+        SELECT movie_id, COUNT(*), COALESCE(SUM(rating), 0), {buckets}
+        FROM reviews
+        GROUP BY movie_id;
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('movie_rating_stats')
@@ -0,0 +1,30 @@
+"""add updated_at to movies and reviews
+
+Revision ID: a8d4e2f6c150
+Revises: f1a9c4e7b352
+Create Date: 2026-10-17 18:03:41.526310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d4e2f6c150'
+down_revision: Union[str, None] = 'f1a9c4e7b352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    for table in ('movies', 'reviews'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()))
+        # Existing rows have not changed since they were created
+        op.execute(f"UPDATE {table} SET updated_at = created_at")
+
+
+def downgrade() -> None:
+    op.drop_column('reviews', 'updated_at')
+    op.drop_column('movies', 'updated_at')
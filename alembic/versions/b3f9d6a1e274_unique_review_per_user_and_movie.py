@@ -0,0 +1,67 @@
+"""unique review per (movie_id, user_id)
+
+Revision ID: b3f9d6a1e274
+Revises: a8d4e2f6c150
+Create Date: 2026-10-17 18:47:12.803455
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f9d6a1e274'
+down_revision: Union[str, None] = 'a8d4e2f6c150'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The old check-then-insert could race; keep each user's newest review.
+    op.execute("""
+        CREATE TEMPORARY TABLE duplicated_review_movies AS
+        SELECT DISTINCT r.movie_id
+        FROM reviews r
+        JOIN reviews newer
+          ON newer.movie_id = r.movie_id
+         AND newer.user_id = r.user_id
+         AND newer.id > r.id
+    """)
+    op.execute("""
+        DELETE FROM reviews r
+        USING reviews newer
+        WHERE newer.movie_id = r.movie_id
+          AND newer.user_id = r.user_id
+          AND newer.id > r.id
+    """)
+
+    # movie_rating_stats was backfilled (a41f0e6d2b17) with the duplicates
+    # counted; recompute those movies with the same aggregate
+    buckets = ", ".join(
+        f"COUNT(*) FILTER (WHERE rating >= {i} AND rating < {i + 1})" if i < 10
+        else "COUNT(*) FILTER (WHERE rating >= 10)"
+        for i in range(11)
+    )
+    columns = ", ".join(f"hist_{i}" for i in range(11))
+    op.execute("""
+        DELETE FROM movie_rating_stats
+        WHERE movie_id IN (SELECT movie_id FROM duplicated_review_movies)
+    """)
+    op.execute(f"""
+        INSERT INTO movie_rating_stats (movie_id, review_count, rating_sum, {columns})
+        SELECT movie_id, COUNT(*), COALESCE(SUM(rating), 0), {buckets}
+        FROM reviews
+        WHERE movie_id IN (SELECT movie_id FROM duplicated_review_movies)
+        GROUP BY movie_id
+    """)
+    op.execute("DROP TABLE duplicated_review_movies")
+
+    op.drop_index('idx_review_movie_user', table_name='reviews')
+    op.create_index('uq_reviews_movie_user', 'reviews', ['movie_id', 'user_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_reviews_movie_user', table_name='reviews')
+    op.create_index('idx_review_movie_user', 'reviews', ['movie_id', 'user_id'], unique=False)
@@ -0,0 +1,32 @@
+"""add pg_trgm GIN index on movie titles
+
+Revision ID: c7e2b9f4a813
+Revises: a41f0e6d2b17
+Create Date: 2026-10-17 13:08:52.266730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e2b9f4a813'
+down_revision: Union[str, None] = 'a41f0e6d2b17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+
+    # Serves both `title ILIKE '%q%'` and `title % q` in search
+    op.execute("""
+        CREATE INDEX idx_movies_title_trgm 
+        ON movies USING GIN (title gin_trgm_ops);
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_movies_title_trgm;")
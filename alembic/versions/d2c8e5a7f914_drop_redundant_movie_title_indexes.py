@@ -0,0 +1,30 @@
+"""drop redundant movie title indexes
+
+Revision ID: d2c8e5a7f914
+Revises: b3f9d6a1e274
+Create Date: 2026-10-17 21:05:38.219604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2c8e5a7f914'
+down_revision: Union[str, None] = 'b3f9d6a1e274'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # uq_movies_title serves every title lookup the plain indexes did; these two
+    # only added write cost to every insert and title change
+    op.drop_index('ix_movies_title', table_name='movies')
+    op.drop_index('idx_movie_title', table_name='movies')
+
+
+def downgrade() -> None:
+    op.create_index('idx_movie_title', 'movies', ['title'], unique=False)
+    op.create_index('ix_movies_title', 'movies', ['title'], unique=False)
@@ -0,0 +1,26 @@
+"""add users.token_version
+
+Revision ID: d83a5c1e6f20
+Revises: c7e2b9f4a813
+Create Date: 2026-10-17 14:41:05.117392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd83a5c1e6f20'
+down_revision: Union[str, None] = 'c7e2b9f4a813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
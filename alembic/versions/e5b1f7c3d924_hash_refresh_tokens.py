@@ -0,0 +1,39 @@
+"""store refresh tokens as SHA-256 digests
+
+Revision ID: e5b1f7c3d924
+Revises: d83a5c1e6f20
+Create Date: 2026-10-17 15:36:48.530219
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b1f7c3d924'
+down_revision: Union[str, None] = 'd83a5c1e6f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('refresh_tokens', sa.Column('token_hash', sa.String(length=64), nullable=True))
+
+    # Existing sessions keep working: hash the stored JWTs in place
+    op.execute("UPDATE refresh_tokens SET token_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex');")
+
+    op.alter_column('refresh_tokens', 'token_hash', nullable=False)
+    op.create_unique_constraint('uq_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'])
+    op.drop_column('refresh_tokens', 'token')
+
+
+def downgrade() -> None:
+    # Raw tokens cannot be recovered from their digests, so every session
+    # is dropped on downgrade
+    op.execute("DELETE FROM refresh_tokens;")
+    op.add_column('refresh_tokens', sa.Column('token', sa.String(), nullable=False))
+    op.create_unique_constraint('refresh_tokens_token_key', 'refresh_tokens', ['token'])
+    op.drop_constraint('uq_refresh_tokens_token_hash', 'refresh_tokens', type_='unique')
+    op.drop_column('refresh_tokens', 'token_hash')
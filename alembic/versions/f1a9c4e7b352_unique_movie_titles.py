@@ -0,0 +1,28 @@
+"""unique index on movies.title for bulk upserts
+
+Revision ID: f1a9c4e7b352
+Revises: e5b1f7c3d924
+Create Date: 2026-10-17 16:52:19.044871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a9c4e7b352'
+down_revision: Union[str, None] = 'e5b1f7c3d924'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ON CONFLICT (title) needs a unique index to arbitrate against.
+    # Fails if duplicate titles already exist; merge those first.
+    op.create_index('uq_movies_title', 'movies', ['title'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_movies_title', table_name='movies')
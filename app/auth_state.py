@@ -0,0 +1,125 @@
+# Per-user token version, checked on every authenticated request.
+#
+# Access tokens carry the user's role and token_version as claims, so
+# get_current_user does not need the users row. A token is honoured only while
+# its version matches the current one; bumping the version (role change,
+# forced logout) revokes every outstanding access token for that user.
+#
+# Lookups go in-process cache -> Redis -> Postgres. Bumps update Redis and
+# broadcast over the cache invalidation channel so other workers drop their
+# in-process copy immediately.
+
+import os
+import redis
+from datetime import datetime
+from sqlalchemy import select, update
+from starlette.concurrency import run_in_threadpool
+from app.local_cache import LocalCache
+from app.models import User
+from app.redis_client import r, CACHE_PREFIX, cache_stats, publish_invalidation, register_invalidation_handler, invalidations_live
+
+AUTH_STATE_TTL = int(os.getenv("AUTH_STATE_TTL", "3600"))
+AUTH_STATE_LOCAL_TTL = float(os.getenv("AUTH_STATE_LOCAL_TTL", "30"))
+
+_local_versions = LocalCache(maxsize=int(os.getenv("AUTH_STATE_LOCAL_SIZE", "10000")), ttl=AUTH_STATE_LOCAL_TTL)
+
+
+def _version_key(user_id: int) -> str:
+    return f"{CACHE_PREFIX}:user:{user_id}:tv"
+
+
+def _get_redis_version(user_id: int):
+    try:
+        value = r.get(_version_key(user_id))
+        return int(value) if value is not None else None
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis get error: {e}")
+        return None
+
+
+def _set_redis_version(user_id: int, version: int, only_if_missing: bool = False):
+    # Back-fills from the database use NX so they can never overwrite a
+    # newer version written by a concurrent bump
+    try:
+        r.set(_version_key(user_id), version, ex=AUTH_STATE_TTL, nx=only_if_missing)
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis set error: {e}")
+
+
+async def get_token_version(db, user_id: int):
+    """Current token version for user_id, or None if the user does not exist."""
+    # The in-process copy is only trusted while bumps can reach us
+    if invalidations_live():
+        version = _local_versions.get(user_id)
+        if version is not None:
+            return version
+
+    version = await run_in_threadpool(_get_redis_version, user_id)
+    if version is None:
+        version = await db.scalar(select(User.token_version).where(User.id == user_id))
+        if version is None:
+            return None
+        await run_in_threadpool(_set_redis_version, user_id, version, True)
+
+    if invalidations_live():
+        _local_versions.set(user_id, version)
+    return version
+
+
+async def bump_token_version(db, user_id: int, **values):
+    """Invalidate all of a user's access tokens, optionally updating columns.
+
+    Commits, so the new version is visible before any cache learns of it.
+    """
+    version = await db.scalar(
+        update(User)
+        .where(User.id == user_id)
+        .values(token_version=User.token_version + 1, **values)
+        .returning(User.token_version)
+    )
+    await db.commit()
+    if version is None:
+        return None
+
+    _local_versions.set(user_id, version)
+    await run_in_threadpool(_set_redis_version, user_id, version)
+    await run_in_threadpool(publish_invalidation, {"op": "auth", "user_id": user_id})
+    return version
+
+
+def _revoked_refresh_key(token_hash: str) -> str:
+    return f"{CACHE_PREFIX}:rt:revoked:{token_hash}"
+
+
+def mark_refresh_tokens_revoked(tokens):
+    """Record (token_hash, expires_at) pairs as unusable until they expire anyway."""
+    now = datetime.utcnow()
+    try:
+        pipe = r.pipeline()
+        for token_hash, expires_at in tokens:
+            ttl = int((expires_at - now).total_seconds()) if expires_at else AUTH_STATE_TTL
+            if ttl > 0:
+                pipe.setex(_revoked_refresh_key(token_hash), ttl, 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis set error: {e}")
+
+
+def is_refresh_token_revoked(token_hash: str) -> bool:
+    """Fast negative check; False means "ask Postgres", not "valid"."""
+    try:
+        return bool(r.exists(_revoked_refresh_key(token_hash)))
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis get error: {e}")
+        return False
+
+
+def _apply_auth_message(message: dict):
+    _local_versions.delete(message["user_id"])
+
+
+register_invalidation_handler("auth", _apply_auth_message)
@@ -0,0 +1,187 @@
+# Bulk movie ingest: stream rows into a temporary staging table (COPY on
+# Postgres), then fold them into movies with a single INSERT ... ON CONFLICT
+# (title) DO UPDATE. Used by POST /movies/bulk and the seeder.
+
+import csv
+import io
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, literal, or_, select
+from app.database import upsert_insert
+from app.models import Movie
+from app.schemas import MovieCreate
+
+BULK_BATCH_SIZE = 5000
+STAGING_COLUMNS = ["title", "description", "genre", "release_year"]
+
+_staging_metadata = MetaData()
+movie_staging = Table(
+    "movie_staging",
+    _staging_metadata,
+    # Later rows for the same title win
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("title", String, nullable=False),
+    Column("description", String),
+    Column("genre", String),
+    Column("release_year", Integer),
+    prefixes=["TEMPORARY"],
+)
+
+
+def _invalid_row(line_no: int, error):
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"Invalid movie on line {line_no}: {error}",
+    )
+
+
+def validate_movie(line_no: int, data) -> dict:
+    """One movie as a MovieCreate dict, or a 422 naming the offending line."""
+    try:
+        return MovieCreate.model_validate(data).model_dump()
+    except ValidationError as e:
+        raise _invalid_row(line_no, e.errors()[0]["msg"])
+
+
+def _decode(data) -> str:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Body is not valid UTF-8: {e}")
+
+
+async def _lines(stream):
+    """Decode a byte stream into lines without buffering the whole body.
+
+    Chunks are split on b"\n" before decoding: a multibyte character may
+    straddle two chunks, but a newline byte never occurs inside one.
+    """
+    pending = bytearray()
+    async for chunk in stream:
+        scanned = len(pending)
+        # In place, so a line spanning many chunks is not copied per chunk
+        pending += chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        end = pending.rfind(b"\n", scanned)
+        if end < 0:
+            continue
+        for line in _decode(pending[:end]).split("\n"):
+            yield line
+        del pending[:end + 1]
+    if pending:
+        yield _decode(pending)
+
+
+async def parse_ndjson(stream):
+    line_no = 0
+    async for line in _lines(stream):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            raise _invalid_row(line_no, e)
+        yield validate_movie(line_no, data)
+
+
+async def parse_csv(stream):
+    header = None
+    record = ""
+    line_no = 0
+    async for line in _lines(stream):
+        line_no += 1
+        record += line if not record else "\n" + line
+        # A quoted field may span lines; wait until its quotes balance
+        if record.count('"') % 2:
+            continue
+        if not record.strip():
+            record = ""
+            continue
+        fields = next(csv.reader([record]))
+        record = ""
+        if header is None:
+            header = [name.strip() for name in fields]
+            continue
+        data = {k: (v if v != "" else None) for k, v in zip(header, fields)}
+        yield validate_movie(line_no, data)
+
+
+async def _stage_batch(db, rows):
+    driver = db.get_bind().dialect.driver
+    records = [tuple(row[c] for c in STAGING_COLUMNS) for row in rows]
+
+    if driver == "asyncpg":
+        raw = await (await db.connection()).get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "movie_staging", records=records, columns=STAGING_COLUMNS
+        )
+    elif driver == "psycopg2":
+        def copy(session):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(records)
+            buffer.seek(0)
+            cursor = session.connection().connection.driver_connection.cursor()
+            cursor.copy_expert(
+                f"COPY movie_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        await db.run_sync(copy)
+    else:
+        await db.execute(insert(movie_staging), rows)
+
+
+async def bulk_upsert_movies(db, rows) -> list:
+    """Upsert an (async) iterable of movie dicts by title; commits.
+
+    Returns the (id, title) of every inserted or changed movie.
+    """
+    await db.run_sync(lambda session: movie_staging.create(session.connection()))
+    try:
+        batch = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= BULK_BATCH_SIZE:
+                await _stage_batch(db, batch)
+                batch = []
+        if batch:
+            await _stage_batch(db, batch)
+
+        now = datetime.utcnow()
+        latest = select(func.max(movie_staging.c.seq)).group_by(movie_staging.c.title)
+        source = select(
+            movie_staging.c.title,
+            movie_staging.c.description,
+            movie_staging.c.genre,
+            movie_staging.c.release_year,
+            literal(now, DateTime),
+            literal(now, DateTime),
+        ).where(movie_staging.c.seq.in_(latest.scalar_subquery()))
+
+        stmt = upsert_insert(db, Movie.__table__).from_select(
+            [*STAGING_COLUMNS, "created_at", "updated_at"], source
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Movie.title],
+            set_={
+                **{c: stmt.excluded[c] for c in STAGING_COLUMNS if c != "title"},
+                # Python-side onupdate does not apply to ON CONFLICT DO UPDATE
+                "updated_at": stmt.excluded.updated_at,
+            },
+            # Identical rows are left alone, so their validators and caches survive
+            where=or_(*(
+                getattr(Movie, c).is_distinct_from(stmt.excluded[c]) for c in STAGING_COLUMNS if c != "title"
+            )),
+        ).returning(Movie.id, Movie.title)
+
+        upserted = (await db.execute(stmt)).all()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        # SQLite does not roll back the CREATE, so a request rejected halfway
+        # (e.g. a 422 on a bad row) must not leave the table behind
+        await db.run_sync(lambda session: movie_staging.drop(session.connection(), checkfirst=True))
+    await db.commit()
+    return upserted
@@ -0,0 +1,117 @@
+# Stampede-safe cache filling.
+#
+# get_or_compute() wraps an expensive async computation so that, per key:
+#   * only one coroutine per worker runs it at a time (in-process single flight),
+#   * only one worker across the fleet runs it at a time (short Redis lock),
+#     while the others poll the cache for its result,
+#   * hot entries are recomputed shortly *before* they expire, with a
+#     probability that rises as expiry approaches (XFetch), so a popular key
+#     never falls out of the cache for everyone at once.
+
+import asyncio
+import math
+import os
+import random
+import time
+from starlette.concurrency import run_in_threadpool
+from app.redis_client import get_cached, set_cache, acquire_lock, release_lock, lock_held, SEARCH_NAMESPACE
+
+FILL_LOCK_TTL_MS = int(os.getenv("CACHE_FILL_LOCK_TTL_MS", "5000"))
+FILL_POLL_INTERVAL = float(os.getenv("CACHE_FILL_POLL_INTERVAL", "0.05"))
+EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1.0"))
+
+_inflight = {}
+
+
+def _should_refresh_early(entry: dict) -> bool:
+    # XFetch: -delta * beta * ln(U) is an exponential head start scaled by
+    # how long the value took to compute
+    head_start = -entry["delta"] * EARLY_REFRESH_BETA * math.log(random.random() or 1e-12)
+    return time.time() + head_start >= entry["expires_at"]
+
+
+async def _compute_and_store(key, compute, ttl, namespace, tags):
+    started = time.time()
+    value = await compute()
+    delta = time.time() - started
+    entry = {"value": value, "delta": delta, "expires_at": time.time() + ttl}
+    await run_in_threadpool(set_cache, key, entry, ttl, namespace, tags(value))
+    return value
+
+
+async def _fill(key, compute, ttl, namespace, tags):
+    lock_name = f"fill:{namespace}:{key}"
+    deadline = time.monotonic() + FILL_LOCK_TTL_MS / 1000
+    while True:
+        token = await run_in_threadpool(acquire_lock, lock_name, FILL_LOCK_TTL_MS)
+        if token is not None:
+            try:
+                return await _compute_and_store(key, compute, ttl, namespace, tags)
+            finally:
+                await run_in_threadpool(release_lock, lock_name, token)
+
+        # Another worker is computing; wait for its result instead of piling on
+        while time.monotonic() < deadline:
+            await asyncio.sleep(FILL_POLL_INTERVAL)
+            entry = await run_in_threadpool(get_cached, key, namespace)
+            if entry is not None:
+                return entry["value"]
+            if not await run_in_threadpool(lock_held, lock_name):
+                break
+        else:
+            # Holder is stuck or slow; stop waiting and compute ourselves
+            return await _compute_and_store(key, compute, ttl, namespace, tags)
+
+
+async def _single_flight(flight_key, coro):
+    future = asyncio.get_running_loop().create_future()
+    _inflight[flight_key] = future
+    try:
+        value = await coro
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark retrieved so a failure nobody waited on is not logged
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(flight_key, None)
+
+
+async def _refresh_early(key, compute, ttl, namespace, tags, token):
+    try:
+        return await _compute_and_store(key, compute, ttl, namespace, tags)
+    finally:
+        await run_in_threadpool(release_lock, f"fill:{namespace}:{key}", token)
+
+
+async def get_or_compute(key: str, compute, ttl: int = 300, namespace: str = SEARCH_NAMESPACE, tags=lambda value: ()):
+    """Return the cached value for key, computing it at most once per fleet.
+
+    compute is a zero-argument coroutine function; tags maps its result to
+    the cache tags the entry should be registered under.
+    """
+    flight_key = (namespace, key)
+    entry = await run_in_threadpool(get_cached, key, namespace)
+
+    if entry is not None:
+        if flight_key in _inflight or not _should_refresh_early(entry):
+            return entry["value"]
+        # Only the lock holder refreshes; everyone else keeps serving the
+        # still-valid entry in the meantime
+        token = await run_in_threadpool(acquire_lock, f"fill:{namespace}:{key}", FILL_LOCK_TTL_MS)
+        if token is None:
+            return entry["value"]
+        try:
+            return await _single_flight(flight_key, _refresh_early(key, compute, ttl, namespace, tags, token))
+        except Exception:
+            return entry["value"]
+
+    if flight_key in _inflight:
+        return await asyncio.shield(_inflight[flight_key])
+
+    return await _single_flight(flight_key, _fill(key, compute, ttl, namespace, tags))
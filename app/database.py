@@ -1,29 +1,360 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from fastapi import Depends, Request
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.concurrency import run_in_threadpool
+import itertools
+import logging
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL environment variable is required")
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True
-)
+# When enabled, request handlers talk to Postgres through an AsyncEngine
+# (asyncpg) instead of borrowing a threadpool worker for every round trip.
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "false").lower() == "true"
+
+
+def _to_async_url(url: str) -> str:
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _to_async_url(DATABASE_URL)
+
+# Optional read replicas (comma-separated URLs) for get_read_db routes
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# How long a failed or lagging replica is skipped, and how often all are probed
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "10"))
+# Replicas further behind than this stop receiving reads
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+
+# Pool sizing is per engine and per process: size + overflow across all
+# workers must stay under Postgres' max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds before a connection is replaced (-1 never); keep below any idle
+# timeout enforced by PgBouncer or a load balancer
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Longest a request waits for a free connection before it gets a 503
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_RETRY_AFTER = os.getenv("DB_POOL_RETRY_AFTER", "1")
+
+
+def _pool_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    # SQLite picks its own single-connection/static pools, which take no sizing
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+# Requests issuing more statements than this are logged as likely N+1s
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "10"))
+
+
+class QueryStats:
+    """Statements executed, and time spent in them, for one request."""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Shared by reference with the threadpool workers and greenlets a request
+# runs its queries on, so it must be mutated in place, never re-set
+_query_stats: ContextVar = ContextVar("query_stats", default=None)
+
+
+def start_query_stats() -> QueryStats:
+    stats = QueryStats()
+    _query_stats.set(stats)
+    return stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - started
+
+
+def _handle_error(context):
+    # Failed statements never reach after_cursor_execute
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    """Count statements and DB time per request on a (sync) Engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL))
+
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
-def get_db():
-    db = SessionLocal()
+async_engine = None
+AsyncSessionLocal = None
+if USE_ASYNC_DB:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_options(ASYNC_DATABASE_URL))
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+# INSERT constructs that support ON CONFLICT, per dialect we run on
+_UPSERT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def upsert_insert(db, table):
+    """An INSERT into `table` for the session's dialect, with on_conflict_do_*()."""
+    return _UPSERT_DIALECTS[db.get_bind().dialect.name](table)
+
+
+class ThreadedSession:
+    """Exposes a sync Session through the AsyncSession API.
+
+    Handlers are written once against the awaitable API; in sync mode
+    (SQLite tests, psycopg2 deployments) each call runs in the threadpool.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def get_bind(self):
+        return self.sync_session.get_bind()
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kw):
+        kw.setdefault("execution_options", {"prebuffer_rows": True})
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kw)
+
+    async def scalar(self, statement, params=None, **kw):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kw)
+
+    async def scalars(self, statement, params=None, **kw):
+        result = await self.execute(statement, params, **kw)
+        return result.scalars()
+
+    async def get(self, entity, ident, **kw):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kw)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def run_sync(self, fn, *args, **kw):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kw)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+async def get_db():
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
+    db = ThreadedSession(SessionLocal())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+@asynccontextmanager
+async def open_session():
+    """A session owned by the caller rather than the request.
+
+    Dependencies are torn down before a StreamingResponse body is sent, so
+    streaming endpoints open their own session inside the body generator.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
+    db = ThreadedSession(SessionLocal())
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+def get_session_factory():
+    return open_session
+
+
+async def stream_partitions(db, statement, size: int):
+    """Yield lists of rows from a server-side cursor, `size` rows at a time."""
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(db, ThreadedSession):
+        result = await run_in_threadpool(db.sync_session.execute, statement)
+        partitions = result.partitions()
+        try:
+            while True:
+                rows = await run_in_threadpool(next, partitions, None)
+                if rows is None:
+                    return
+                yield rows
+        finally:
+            await run_in_threadpool(result.close)
+    else:
+        result = await db.stream(statement)
+        try:
+            async for rows in result.partitions():
+                yield rows
+        finally:
+            await result.close()
+
+
+class Replica:
+
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = create_engine(url, **_pool_options(url))
+        instrument_engine(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
+        self.async_engine = None
+        self.async_session_factory = None
+        if USE_ASYNC_DB:
+            async_url = _to_async_url(url)
+            self.async_engine = create_async_engine(async_url, **_pool_options(async_url))
+            instrument_engine(self.async_engine.sync_engine)
+            self.async_session_factory = async_sessionmaker(
+                bind=self.async_engine, autoflush=False, expire_on_commit=False
+            )
+        # Skipped by choose() until this monotonic time
+        self.down_until = 0.0
+
+    def session(self):
+        if self.async_session_factory is not None:
+            return self.async_session_factory()
+        return ThreadedSession(self.session_factory())
+
 
+class ReplicaSet:
+    """Round-robin over the replicas that are currently usable."""
 
+    def __init__(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+        self._turn = itertools.count()
 
+    def __bool__(self):
+        return bool(self.replicas)
 
+    def choose(self):
+        """Next healthy replica, or None to fall back to the primary."""
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._turn) % len(self.replicas)]
+            if replica.down_until <= now:
+                return replica
+        return None
 
+    def mark_down(self, replica: Replica, reason: str):
+        if replica.down_until <= time.monotonic():
+            logger.warning(f"Replica {replica.name} taken out of rotation: {reason}")
+        replica.down_until = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+
+    def check(self):
+        """Probe every replica for reachability and replication lag (sync)."""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    lag = 0.0
+                    if conn.dialect.name == "postgresql":
+                        # A caught-up replica of an idle primary has an old
+                        # replay timestamp but no outstanding WAL
+                        lag = conn.scalar(text(
+                            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                        ))
+                if lag > DB_REPLICA_MAX_LAG_SECONDS:
+                    self.mark_down(replica, f"{lag:.1f}s behind the primary")
+                elif replica.down_until > time.monotonic():
+                    logger.info(f"Replica {replica.name} back in rotation")
+                    replica.down_until = 0.0
+            except Exception as e:
+                self.mark_down(replica, str(e))
+
+
+replica_set = ReplicaSet(DATABASE_REPLICA_URLS)
+
+
+async def get_read_db(request: Request, db=Depends(get_db)):
+    """Session for read-only routes: a replica when one is usable.
+
+    Falls back to the primary session (which does not connect unless used)
+    when no replica is configured or healthy, and when the caller wrote
+    something recently enough that a replica may not have it yet.
+    """
+    replica = None
+    if replica_set and not getattr(request.state, "read_from_primary", False):
+        replica = replica_set.choose()
+    if replica is None:
+        yield db
+        return
+
+    session = replica.session()
+    try:
+        yield session
+    except (OperationalError, InterfaceError) as e:
+        replica_set.mark_down(replica, str(e.orig or e))
+        raise
+    finally:
+        await session.close()
@@ -1,32 +1,49 @@
+from dataclasses import dataclass
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from app.utils import decode_access_token
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.utils import decode_access_token_claims
 from app.database import get_db
 from app.models import User
+from app.auth_state import get_token_version
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    user_id = decode_access_token(token)
-    if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: int
+    role: str
+    token_version: int
 
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return user
+def _credentials_error(detail: str):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    claims = decode_access_token_claims(token)
+    if claims is None:
+        raise _credentials_error("Could not validate credentials")
+    user_id = int(claims["sub"])
+
+    # Tokens minted before role/version claims existed still need the row
+    if "tv" not in claims or "role" not in claims:
+        user = await db.get(User, user_id)
+        if not user:
+            raise _credentials_error("User not found")
+        return AuthenticatedUser(id=user.id, role=user.role, token_version=user.token_version)
+
+    version = await get_token_version(db, user_id)
+    if version is None:
+        raise _credentials_error("User not found")
+    if version != claims["tv"]:
+        raise _credentials_error("Token has been revoked")
+    return AuthenticatedUser(id=user_id, role=claims["role"], token_version=version)
 
 def require_role(role: str):
-    def role_checker(current_user: User = Depends(get_current_user)):
+    async def role_checker(current_user: AuthenticatedUser = Depends(get_current_user)):
         if current_user.role != role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -34,4 +51,3 @@ def require_role(role: str):
             )
         return current_user
     return role_checker
-
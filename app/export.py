@@ -0,0 +1,81 @@
+# Streaming NDJSON/CSV exports.
+#
+# Rows come off a server-side cursor EXPORT_BATCH_SIZE at a time and are
+# serialized (and optionally gzipped) as they arrive, so memory stays flat
+# however large the table is. The whole export is one SELECT, i.e. one
+# consistent snapshot.
+
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.database import stream_partitions
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _ndjson_chunk(rows) -> bytes:
+    return "".join(
+        json.dumps({k: _jsonable(v) for k, v in row.items()}) + "\n" for row in rows
+    ).encode("utf-8")
+
+
+def _csv_chunk(rows, header=None) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows(
+        ["" if v is None else _jsonable(v) for v in row.values()] for row in rows
+    )
+    return buffer.getvalue().encode("utf-8")
+
+
+async def _encode(session_factory, statement, fmt: str):
+    async with session_factory() as db:
+        if fmt == "csv":
+            # Header goes out even when there are no rows
+            yield _csv_chunk([], header=[c.name for c in statement.selected_columns])
+        async for rows in stream_partitions(db, statement, EXPORT_BATCH_SIZE):
+            rows = [row._mapping for row in rows]
+            yield _ndjson_chunk(rows) if fmt == "ndjson" else _csv_chunk(rows)
+
+
+async def _gzip(chunks):
+    # wbits=31 -> gzip container, compressed incrementally per chunk
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(request: Request, session_factory, statement, fmt: str, filename: str):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {fmt}")
+
+    body = _encode(session_factory, statement, fmt)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = _gzip(body)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[fmt], headers=headers)
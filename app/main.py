@@ -1,8 +1,113 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.concurrency import run_in_threadpool
 from routers import auth, movies, reviews
 from routers.services import search_service, admin_service
+from app.redis_client import start_invalidation_listener
+from app.title_index import reload_title_index, SUGGEST_REFRESH_SECONDS
+from app.password_pool import shutdown_pool
+from app.token_cleanup import run_token_reaper, TOKEN_REAPER_INTERVAL_SECONDS
+from app.database import start_query_stats, replica_set, QUERY_BUDGET, DB_POOL_RETRY_AFTER, DB_REPLICA_CHECK_SECONDS
+from app.review_ingest import REVIEW_WRITE_BEHIND, REVIEW_INGEST_IN_PROCESS, run_review_inserter
+from app.read_your_writes import bearer_user_id, has_recent_write, mark_recent_write, SAFE_METHODS
+from app import metrics
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+
+async def refresh_title_index_periodically():
+    while True:
+        await asyncio.sleep(SUGGEST_REFRESH_SECONDS)
+        await run_in_threadpool(reload_title_index)
+
+
+async def check_replicas_periodically():
+    while True:
+        await run_in_threadpool(replica_set.check)
+        await asyncio.sleep(DB_REPLICA_CHECK_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_invalidation_listener()
+    await run_in_threadpool(reload_title_index)
+    background = [asyncio.create_task(refresh_title_index_periodically())]
+    if TOKEN_REAPER_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(run_token_reaper()))
+    if replica_set:
+        background.append(asyncio.create_task(check_replicas_periodically()))
+    if REVIEW_WRITE_BEHIND and REVIEW_INGEST_IN_PROCESS:
+        background.append(asyncio.create_task(run_review_inserter()))
+    yield
+    for task in background:
+        task.cancel()
+    shutdown_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    stats = start_query_stats()
+    started = time.perf_counter()
+    status_code = 500
+    metrics.request_started()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        # Label by route template, never the raw path, to bound cardinality
+        route = request.scope.get("route")
+        metrics.request_finished(
+            request.method,
+            route.path if route is not None else "unmatched",
+            status_code,
+            time.perf_counter() - started,
+            stats,
+        )
+
+    response.headers["Server-Timing"] = f'db;desc="{stats.count} queries";dur={stats.seconds * 1000:.2f}'
+    if stats.count > QUERY_BUDGET:
+        logger.warning(
+            f"{request.method} {request.url.path} issued {stats.count} queries "
+            f"({stats.seconds * 1000:.1f} ms), over the budget of {QUERY_BUDGET}"
+        )
+    return response
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    if not replica_set:
+        return await call_next(request)
+
+    user_id = bearer_user_id(request)
+    if request.method in SAFE_METHODS:
+        # Seen by get_read_db through the shared request scope
+        if user_id is not None and await run_in_threadpool(has_recent_write, user_id):
+            request.state.read_from_primary = True
+        return await call_next(request)
+
+    response = await call_next(request)
+    # Recorded before the response goes out, so the client's next read sees it
+    if user_id is not None and response.status_code < 400:
+        await run_in_threadpool(mark_recent_write, user_id)
+    return response
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_exhausted(request: Request, exc: PoolTimeoutError):
+    # Every connection stayed busy for DB_POOL_TIMEOUT; shed the request
+    # rather than queueing it behind work that is already late
+    metrics.pool_timeout()
+    logger.warning(f"{request.method} {request.url.path} rejected: connection pool exhausted")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Service is busy, please retry"},
+        headers={"Retry-After": DB_POOL_RETRY_AFTER},
+    )
 
 app.include_router(auth.router, prefix="/auth")
 app.include_router(movies.router, prefix="/movies")
@@ -10,6 +115,10 @@ app.include_router(reviews.router)
 app.include_router(search_service.router, prefix="/search")
 app.include_router(admin_service.router, prefix="/movies")
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(await metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/")
 def hello():
     return {"message": "Hello, World....This is Prashanth Surapaneni!"}
@@ -0,0 +1,180 @@
+# Prometheus text-format metrics for GET /metrics.
+#
+# Request latency and in-flight counts are recorded by a middleware; everything
+# else (connection pool, cache counters, bcrypt timings, token table sizes) is
+# read from the modules that already track it at scrape time. Values are per
+# process: with several uvicorn workers each one is scraped on its own.
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from starlette.concurrency import run_in_threadpool
+from app import database
+from app.database import engine, async_engine
+from app.redis_client import get_cache_stats
+from app.password_pool import hashing_stats, pending_jobs
+from app.token_cleanup import get_token_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# get_token_stats scans refresh_tokens, so scrapes reuse a recent result
+TOKEN_METRICS_TTL = float(os.getenv("TOKEN_METRICS_TTL", "60"))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in sorted(self._series.items())]
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + (bound,))} {cumulative}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+_in_flight = 0
+_pool_timeouts = 0
+# Statement totals from the per-request QueryStats
+_db_totals = {"queries": 0, "seconds": 0.0}
+
+_token_stats = None
+_token_stats_at = 0.0
+
+
+def request_started():
+    global _in_flight
+    _in_flight += 1
+
+
+def request_finished(method: str, route: str, status: int, seconds: float, query_stats=None):
+    global _in_flight
+    _in_flight -= 1
+    request_latency.observe(seconds, method, route, str(status))
+    if query_stats is not None:
+        _db_totals["queries"] += query_stats.count
+        _db_totals["seconds"] += query_stats.seconds
+
+
+def pool_timeout():
+    global _pool_timeouts
+    _pool_timeouts += 1
+
+
+def _metric(lines, name, kind, help, samples):
+    """samples: iterable of (labels dict, value)."""
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+
+
+def _pool_samples():
+    """(labels, pool) for the primary's and every replica's engines."""
+    engines = [("primary", "sync", engine), ("primary", "async", async_engine)]
+    # Read at scrape time: the replica set is built from the environment on import
+    for replica in database.replica_set.replicas:
+        engines += [(replica.name, "sync", replica.engine), (replica.name, "async", replica.async_engine)]
+    for name, kind, target in engines:
+        if target is None:
+            continue
+        pool = target.pool
+        # StaticPool/NullPool (SQLite, tests) do not track checkouts
+        if not hasattr(pool, "checkedout"):
+            continue
+        yield {"database": name, "engine": kind}, pool
+
+
+async def _token_samples():
+    global _token_stats, _token_stats_at
+    if _token_stats is None or time.monotonic() - _token_stats_at > TOKEN_METRICS_TTL:
+        stats = await run_in_threadpool(get_token_stats)
+        if stats is not None:
+            _token_stats, _token_stats_at = stats, time.monotonic()
+    return _token_stats or {}
+
+
+async def render_metrics() -> str:
+    lines = request_latency.render()
+    _metric(lines, "http_requests_in_flight", "gauge", "Requests currently being served", [({}, _in_flight)])
+
+    pools = list(_pool_samples())
+    for name, help, read in (
+        ("db_pool_size", "Configured pool size", lambda p: p.size()),
+        ("db_pool_checked_out", "Connections currently checked out", lambda p: p.checkedout()),
+        ("db_pool_checked_in", "Idle connections in the pool", lambda p: p.checkedin()),
+        ("db_pool_overflow", "Connections open beyond pool_size", lambda p: p.overflow()),
+    ):
+        _metric(lines, name, "gauge", help, [(labels, read(pool)) for labels, pool in pools])
+    _metric(lines, "db_pool_timeouts_total", "counter", "Requests shed because no connection freed up in time",
+            [({}, _pool_timeouts)])
+    _metric(lines, "db_queries_total", "counter", "SQL statements executed by requests", [({}, _db_totals["queries"])])
+    _metric(lines, "db_query_seconds_total", "counter", "Time spent in SQL statements by requests", [({}, _db_totals["seconds"])])
+
+    # Report every result from the first scrape so rate() has a starting point
+    cache = {result: 0 for result in ("local_hit", "local_miss", "redis_hit", "redis_miss", "redis_error")}
+    cache.update(get_cache_stats())
+    _metric(lines, "cache_local_entries", "gauge", "Entries in the in-process cache tier", [({}, cache.pop("local_size", 0))])
+    _metric(
+        lines, "cache_operations_total", "counter", "Cache lookups and Redis errors by result",
+        [({"result": result}, count) for result, count in sorted(cache.items())],
+    )
+
+    ops = ("hash", "verify")
+    _metric(lines, "password_hash_operations_total", "counter", "bcrypt operations completed",
+            [({"op": op}, hashing_stats[op]["count"]) for op in ops])
+    _metric(lines, "password_hash_seconds_total", "counter", "Time spent in bcrypt including queueing",
+            [({"op": op}, hashing_stats[op]["seconds_total"]) for op in ops])
+    _metric(lines, "password_hash_seconds_max", "gauge", "Slowest bcrypt operation since start",
+            [({"op": op}, hashing_stats[op]["seconds_max"]) for op in ops])
+    _metric(lines, "password_hash_rejected_total", "counter", "bcrypt jobs refused with 503",
+            [({}, hashing_stats["rejected"])])
+    _metric(lines, "password_hash_pending", "gauge", "bcrypt jobs queued or running", [({}, pending_jobs())])
+
+    tokens = await _token_samples()
+    _metric(
+        lines, "refresh_tokens", "gauge", "Rows in refresh_tokens by state",
+        [({"state": key.removesuffix("_tokens")}, value) for key, value in sorted(tokens.items())],
+    )
+
+    return "\n".join(lines) + "\n"
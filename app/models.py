@@ -1,4 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, Boolean
 from datetime import timedelta  
 from sqlalchemy.types import DateTime
@@ -16,6 +17,8 @@ class User(Base):
     email = Column(String, unique=True, nullable=False, index=True)
     password_hash = Column(String, nullable=False)
     role = Column(String, default='user')
+    # Embedded in access tokens; bumping it revokes all of them
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Create an index on username and email for faster lookups
@@ -29,17 +32,23 @@ class Movie(Base):
     __tablename__ = 'movies'
     
     id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, nullable=False, index=True)
+    # Indexed by uq_movies_title alone; it serves lookups as well as uniqueness
+    title = Column(String, nullable=False)
     description = Column(String, nullable=True)
     genre = Column(String, nullable=True, index=True)
     release_year = Column(Integer, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Drives ETag/Last-Modified; bulk upserts set it explicitly
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
-    search_vector = Column(TSVECTOR)
+    search_vector = Column(TSVECTOR().with_variant(String(), "sqlite"))
+
+    # Only populated when a query asks for it (selectinload/joinedload)
+    rating_stats = relationship("MovieRatingStats", uselist=False, lazy="noload", passive_deletes=True)
 
     # Create indexes for commonly searched fields
     __table_args__ = (
-        Index('idx_movie_title', 'title'),
+        Index('uq_movies_title', 'title', unique=True),  # Upsert key for bulk ingest
         Index('idx_movie_genre', 'genre'),
         Index('idx_movie_year', 'release_year'),
     )
@@ -53,15 +62,17 @@ class Review(Base):
     rating = Column(Float, nullable=False)
     comment = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
     # Create indexes for foreign keys and commonly queried fields
     # Composite index for finding reviews by movie and user
     __table_args__ = (
         Index('idx_review_user', 'user_id'),
         Index('idx_review_movie', 'movie_id'),
-        Index('idx_review_movie_user', 'movie_id', 'user_id'),  # Composite index
+        Index('uq_reviews_movie_user', 'movie_id', 'user_id', unique=True),  # One review per user and movie
         Index('idx_review_rating', 'rating'),
         Index('idx_review_created', 'created_at'),
+        Index('idx_review_movie_created_id', 'movie_id', 'created_at', 'id'),  # Keyset pagination
     )
 
 class RefreshToken(Base):
@@ -69,7 +80,39 @@ class RefreshToken(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    token = Column(String, unique=True, nullable=False)
+    # SHA-256 hex of the JWT; the raw token is never stored
+    token_hash = Column(String(64), unique=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime, default=lambda: datetime.utcnow() + timedelta(days=7))
-    revoked = Column(Boolean, default=False)
\ No newline at end of file
+    revoked = Column(Boolean, default=False)
+
+RATING_BUCKETS = 11  # whole-point buckets 0..10
+
+class MovieRatingStats(Base):
+    __tablename__ = "movie_rating_stats"
+
+    # Maintained incrementally by app.rating_stats alongside every review write
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True)
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0.0)
+    hist_0 = Column(Integer, nullable=False, default=0)
+    hist_1 = Column(Integer, nullable=False, default=0)
+    hist_2 = Column(Integer, nullable=False, default=0)
+    hist_3 = Column(Integer, nullable=False, default=0)
+    hist_4 = Column(Integer, nullable=False, default=0)
+    hist_5 = Column(Integer, nullable=False, default=0)
+    hist_6 = Column(Integer, nullable=False, default=0)
+    hist_7 = Column(Integer, nullable=False, default=0)
+    hist_8 = Column(Integer, nullable=False, default=0)
+    hist_9 = Column(Integer, nullable=False, default=0)
+    hist_10 = Column(Integer, nullable=False, default=0)
+
+    @property
+    def average_rating(self):
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    @property
+    def histogram(self):
+        return [getattr(self, f"hist_{i}") or 0 for i in range(RATING_BUCKETS)]
@@ -0,0 +1,79 @@
+# Password hashing off the request path.
+#
+# bcrypt is deliberately slow, so running it inline (or in Starlette's shared
+# threadpool) lets a login burst starve every other route. Hashes are computed
+# in a dedicated, size-limited process pool instead; once more than
+# PASSWORD_HASH_MAX_PENDING jobs are queued or running, callers get a fast 503
+# rather than piling up.
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+from app.utils import hash_password, verify_and_update_password
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+PASSWORD_HASH_RETRY_AFTER = os.getenv("PASSWORD_HASH_RETRY_AFTER", "1")
+
+_pool = None
+_pending = 0
+
+# Per-operation timings (queue wait + bcrypt) for the metrics endpoint
+hashing_stats = {
+    op: {"count": 0, "seconds_total": 0.0, "seconds_max": 0.0}
+    for op in ("hash", "verify")
+}
+hashing_stats["rejected"] = 0
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def pending_jobs() -> int:
+    return _pending
+
+
+async def _submit(op: str, fn, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        hashing_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": PASSWORD_HASH_RETRY_AFTER},
+        )
+
+    _pending += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+    finally:
+        _pending -= 1
+        elapsed = time.perf_counter() - started
+        stats = hashing_stats[op]
+        stats["count"] += 1
+        stats["seconds_total"] += elapsed
+        stats["seconds_max"] = max(stats["seconds_max"], elapsed)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _submit("hash", hash_password, password)
+
+
+async def verify_password_async(password: str, hashed_password: str):
+    """Returns (is_valid, new_hash); new_hash is set when the stored hash
+    uses an outdated scheme or cost and should be replaced."""
+    return await _submit("verify", verify_and_update_password, password, hashed_password)
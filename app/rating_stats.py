@@ -0,0 +1,131 @@
+# Incrementally maintained per-movie rating aggregates.
+#
+# Review writes call apply_rating_change() inside their own transaction so the
+# movie_rating_stats row is always consistent with the reviews table, and a
+# movie's count/mean/histogram becomes a single primary-key read.
+
+from sqlalchemy import and_, case, delete, func, insert, select
+from sqlalchemy.orm import Session
+from app.database import SessionLocal, upsert_insert
+from app.models import MovieRatingStats, Review, RATING_BUCKETS
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def rating_bucket(rating: float) -> int:
+    return min(int(rating), RATING_BUCKETS - 1)
+
+
+def _bucket_deltas(old_rating, new_rating):
+    deltas = {}
+    if old_rating is not None:
+        key = f"hist_{rating_bucket(old_rating)}"
+        deltas[key] = deltas.get(key, 0) - 1
+    if new_rating is not None:
+        key = f"hist_{rating_bucket(new_rating)}"
+        deltas[key] = deltas.get(key, 0) + 1
+    return {k: v for k, v in deltas.items() if v}
+
+
+async def apply_rating_change(db, movie_id: int, old_rating: float | None = None, new_rating: float | None = None):
+    """Fold one review insert/update/delete into the movie's aggregate row.
+
+    create: old_rating=None; delete: new_rating=None; update: both set.
+    Runs as a single upsert statement and does not commit.
+    """
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0.0) - (old_rating or 0.0)
+    deltas = {"review_count": count_delta, "rating_sum": sum_delta, **_bucket_deltas(old_rating, new_rating)}
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+
+    table = MovieRatingStats.__table__
+    stmt = upsert_insert(db, table).values(
+        movie_id=movie_id,
+        **{k: max(v, 0) for k, v in deltas.items()},
+    ).on_conflict_do_update(
+        index_elements=[table.c.movie_id],
+        set_={k: table.c[k] + v for k, v in deltas.items()},
+    )
+    await db.execute(stmt)
+
+
+async def apply_new_ratings(db, ratings_by_movie: dict):
+    """Fold freshly inserted reviews for several movies in with one upsert.
+
+    ratings_by_movie maps movie_id -> list of new ratings. Does not commit.
+    """
+    if not ratings_by_movie:
+        return
+
+    rows = []
+    for movie_id, ratings in ratings_by_movie.items():
+        row = {"movie_id": movie_id, "review_count": len(ratings), "rating_sum": float(sum(ratings))}
+        row.update({f"hist_{bucket}": 0 for bucket in range(RATING_BUCKETS)})
+        for rating in ratings:
+            row[f"hist_{rating_bucket(rating)}"] += 1
+        rows.append(row)
+
+    table = MovieRatingStats.__table__
+    stmt = upsert_insert(db, table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.movie_id],
+        set_={k: table.c[k] + stmt.excluded[k] for k in rows[0] if k != "movie_id"},
+    )
+    await db.execute(stmt)
+
+
+def rebuild_rating_stats(movie_id: int | None = None):
+    """Recompute aggregates from the reviews table (backfill / repair)."""
+
+    db: Session = SessionLocal()
+    try:
+        buckets = {
+            f"hist_{i}": func.coalesce(func.sum(case(
+                (
+                    and_(Review.rating >= i, Review.rating < i + 1)
+                    if i < RATING_BUCKETS - 1 else Review.rating >= i,
+                    1
+                ),
+                else_=0,
+            )), 0)
+            for i in range(RATING_BUCKETS)
+        }
+        source = select(
+            Review.movie_id,
+            func.count(Review.id),
+            func.coalesce(func.sum(Review.rating), 0.0),
+            *buckets.values(),
+        ).group_by(Review.movie_id)
+
+        clear = delete(MovieRatingStats)
+        if movie_id is not None:
+            source = source.where(Review.movie_id == movie_id)
+            clear = clear.where(MovieRatingStats.movie_id == movie_id)
+
+        db.execute(clear)
+        result = db.execute(
+            insert(MovieRatingStats).from_select(
+                ["movie_id", "review_count", "rating_sum", *buckets.keys()],
+                source,
+            )
+        )
+        db.commit()
+        logger.info(f"Rebuilt rating stats for {result.rowcount} movies")
+        return result.rowcount
+
+    except Exception as e:
+        logger.error(f"Error rebuilding rating stats: {e}")
+        db.rollback()
+        return -1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("Rebuilding movie rating stats...")
+    rebuilt = rebuild_rating_stats()
+    print(f"Rebuild completed: {rebuilt} movies")
@@ -0,0 +1,45 @@
+# Read-your-writes for replica-routed reads.
+#
+# After an authenticated user's successful write, their reads go to the
+# primary for READ_YOUR_WRITES_SECONDS, so a lagging replica can never hide
+# their own review or edit from them. The marker lives in Redis so it holds
+# whichever worker serves the next request; anonymous reads are never pinned.
+
+import os
+import redis
+from app.redis_client import r, CACHE_PREFIX, cache_stats
+from app.utils import decode_access_token_claims
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def _recent_write_key(user_id) -> str:
+    return f"{CACHE_PREFIX}:rw:{user_id}"
+
+
+def bearer_user_id(request):
+    """The user a request's bearer token names, or None (no DB or Redis access)."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    claims = decode_access_token_claims(token)
+    return claims["sub"] if claims else None
+
+
+def mark_recent_write(user_id):
+    try:
+        r.set(_recent_write_key(user_id), 1, px=int(READ_YOUR_WRITES_SECONDS * 1000))
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis set error: {e}")
+
+
+def has_recent_write(user_id) -> bool:
+    try:
+        return bool(r.exists(_recent_write_key(user_id)))
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis get error: {e}")
+        # Cannot tell, so take the consistent path
+        return True
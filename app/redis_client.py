@@ -1,7 +1,12 @@
 import redis
 import json
 import os
+import threading
+import time
+import uuid
+from collections import Counter
 from dotenv import load_dotenv
+from app.local_cache import LocalCache
 
 load_dotenv()
 
@@ -9,44 +14,245 @@ REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 
+# Every cache key lives under CACHE_PREFIX so we never touch foreign keys
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "mra")
+SEARCH_NAMESPACE = "search"
+
+# In-process tier in front of Redis; LOCAL_CACHE_SIZE=0 disables it
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "1024"))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "30"))
+INVALIDATION_CHANNEL = f"{CACHE_PREFIX}:invalidate"
+
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
 
-def get_cached(key: str):
+local_cache = LocalCache(maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL)
+cache_stats = Counter()
+
+_instance_id = uuid.uuid4().hex
+_generations = {}
+# The local tier is only trusted while we are subscribed to invalidations
+_listener_connected = threading.Event()
+_listener_started = False
+_listener_lock = threading.Lock()
+# Extra invalidation ops ("op" -> callable) registered by other modules
+_invalidation_handlers = {}
+
+# Key layout:
+#   {prefix}:{namespace}:gen            generation counter for the namespace
+#   {prefix}:{namespace}:v{gen}:{key}   cached value
+#   {prefix}:tag:{tag}                  set of value keys registered under a tag
+
+def _generation_key(namespace: str) -> str:
+    return f"{CACHE_PREFIX}:{namespace}:gen"
+
+def _tag_key(tag: str) -> str:
+    return f"{CACHE_PREFIX}:tag:{tag}"
+
+def _generation(namespace: str) -> str:
+    if _listener_connected.is_set():
+        generation = _generations.get(namespace)
+        if generation is not None:
+            return generation
+    generation = r.get(_generation_key(namespace)) or "0"
+    _generations[namespace] = generation
+    return generation
+
+def _cache_key(key: str, namespace: str) -> str:
+    return f"{CACHE_PREFIX}:{namespace}:v{_generation(namespace)}:{key}"
+
+def _publish(message: dict):
+    message["sender"] = _instance_id
+    r.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+def publish_invalidation(message: dict):
+    """Broadcast a message to the other workers' invalidation listeners."""
     try:
-        data = r.get(key)
+        _publish(message)
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis publish error: {e}")
+
+def register_invalidation_handler(op: str, handler):
+    _invalidation_handlers[op] = handler
+
+def invalidations_live() -> bool:
+    """True while this worker is subscribed to the invalidation channel."""
+    return _listener_connected.is_set()
+
+def movie_tag(movie_id: int) -> str:
+    return f"movie:{movie_id}"
+
+def movie_reviews_tag(movie_id: int) -> str:
+    """Entries embedding a movie's reviews or rating stats; review writes drop them."""
+    return f"movie:{movie_id}:reviews"
+
+def get_cache_stats() -> dict:
+    return {**cache_stats, "local_size": len(local_cache)}
+
+def get_cached(key: str, namespace: str = SEARCH_NAMESPACE):
+    try:
+        full_key = _cache_key(key, namespace)
+        use_local = _listener_connected.is_set()
+        if use_local:
+            value = local_cache.get(full_key)
+            if value is not None:
+                cache_stats["local_hit"] += 1
+                return value
+            cache_stats["local_miss"] += 1
+            # Same round trip: the local copy must not outlive the Redis key
+            data, remaining_ms = r.pipeline(transaction=False).get(full_key).pttl(full_key).execute()
+        else:
+            data = r.get(full_key)
+
         if data:
-            return json.loads(data)
+            cache_stats["redis_hit"] += 1
+            value = json.loads(data)
+            if use_local:
+                # PTTL is -1 for a key without an expiry
+                local_cache.set(full_key, value, remaining_ms / 1000 if remaining_ms > 0 else None)
+            return value
+        cache_stats["redis_miss"] += 1
         return None
     except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
         print(f"Redis get error: {e}")
         return None
 
-def set_cache(key: str, value, ttl=300):  
+def set_cache(key: str, value, ttl=300, namespace: str = SEARCH_NAMESPACE, tags=()):
     try:
-        r.setex(key, ttl, json.dumps(value))
+        full_key = _cache_key(key, namespace)
+        pipe = r.pipeline()
+        pipe.setex(full_key, ttl, json.dumps(value))
+        for tag in tags:
+            # Keep the tag set alive as long as its longest-lived member
+            pipe.sadd(_tag_key(tag), full_key)
+            pipe.expire(_tag_key(tag), ttl, gt=True)
+            pipe.expire(_tag_key(tag), ttl, nx=True)
+        pipe.execute()
+        _publish({"op": "del", "keys": [full_key]})
+        if _listener_connected.is_set():
+            local_cache.set(full_key, value, ttl)
     except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
         print(f"Redis set error: {e}")
 
-def delete_cache(key: str):
+def delete_cache(key: str, namespace: str = SEARCH_NAMESPACE):
     try:
-        r.delete(key)
+        full_key = _cache_key(key, namespace)
+        local_cache.delete(full_key)
+        r.delete(full_key)
+        _publish({"op": "del", "keys": [full_key]})
     except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
         print(f"Redis delete error: {e}")
 
-def clear_search_cache():
+def invalidate_tags(*tags: str):
+    """Delete every entry registered under any of the tags; O(tagged keys)."""
+    if not tags:
+        return
+    try:
+        pipe = r.pipeline()
+        for tag in tags:
+            pipe.smembers(_tag_key(tag))
+        members = set().union(*pipe.execute())
+        local_cache.delete(*members)
+        r.delete(*members, *(_tag_key(tag) for tag in tags))
+        if members:
+            _publish({"op": "del", "keys": sorted(members)})
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis tag invalidation error: {e}")
+
+def bump_namespace(namespace: str):
+    """Drop a whole namespace in O(1); orphaned entries age out via TTL."""
+    try:
+        generation = str(r.incr(_generation_key(namespace)))
+        _generations[namespace] = generation
+        _publish({"op": "gen", "namespace": namespace, "gen": generation})
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis namespace bump error: {e}")
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def acquire_lock(name: str, ttl_ms: int):
+    """Short-lived cross-worker lock; returns a release token or None if held.
+
+    Fails open (returns a token) when Redis is unavailable so callers never
+    stall on a broken cache.
+    """
+    token = uuid.uuid4().hex
     try:
-        keys = r.keys("*")
-        search_keys = [key for key in keys if key.islower() and len(key) > 0]
-        if search_keys:
-            r.delete(*search_keys)
+        if r.set(f"{CACHE_PREFIX}:lock:{name}", token, nx=True, px=ttl_ms):
+            return token
+        return None
     except redis.RedisError as e:
-        print(f"Redis clear cache error: {e}")
+        cache_stats["redis_error"] += 1
+        print(f"Redis lock error: {e}")
+        return token
 
-def invalidate_movie_cache(movie_title: str):
+def lock_held(name: str) -> bool:
     try:
-        keys = r.keys("*")
-        for key in keys:
-            if movie_title.lower() in key.lower():
-                r.delete(key)
+        return bool(r.exists(f"{CACHE_PREFIX}:lock:{name}"))
     except redis.RedisError as e:
-        print(f"Redis invalidation error: {e}")
+        cache_stats["redis_error"] += 1
+        print(f"Redis lock error: {e}")
+        return False
+
+def release_lock(name: str, token: str):
+    try:
+        r.eval(_RELEASE_LOCK_SCRIPT, 1, f"{CACHE_PREFIX}:lock:{name}", token)
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis unlock error: {e}")
+
+def clear_search_cache():
+    bump_namespace(SEARCH_NAMESPACE)
+
+def invalidate_movie_cache(movie_id: int):
+    invalidate_tags(movie_tag(movie_id))
+
+def _handle_invalidation(message: dict):
+    if message.get("sender") == _instance_id:
+        return
+    if message.get("op") == "del":
+        local_cache.delete(*message.get("keys", []))
+    elif message.get("op") == "gen":
+        _generations[message["namespace"]] = message["gen"]
+    elif message.get("op") in _invalidation_handlers:
+        _invalidation_handlers[message["op"]](message)
+
+def _listen_for_invalidations():
+    logged_failure = False
+    while True:
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything cached before (re)subscribing may have missed messages
+            local_cache.clear()
+            _generations.clear()
+            _listener_connected.set()
+            logged_failure = False
+            for message in pubsub.listen():
+                if message["type"] == "message":
+                    _handle_invalidation(json.loads(message["data"]))
+        except (redis.RedisError, ValueError) as e:
+            if not logged_failure:
+                print(f"Redis invalidation listener error: {e}")
+                logged_failure = True
+        _listener_connected.clear()
+        time.sleep(1)
+
+def start_invalidation_listener():
+    """Subscribe this worker to cross-process cache invalidations (idempotent)."""
+    global _listener_started
+    with _listener_lock:
+        if _listener_started:
+            return
+        _listener_started = True
+    threading.Thread(target=_listen_for_invalidations, name="cache-invalidation", daemon=True).start()
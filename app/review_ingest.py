@@ -0,0 +1,356 @@
+# Write-behind review ingestion (REVIEW_WRITE_BEHIND=true).
+#
+# POST /movies/{id}/reviews validates the body, appends it to a Redis stream
+# and answers 202 with an ingest id instead of waiting on a Postgres commit.
+# run_review_inserter() drains the stream through a consumer group in
+# multi-row INSERTs, and each submission's outcome is kept in a status hash
+# for GET /reviews/ingest/{id}.
+#
+# Delivery is at-least-once: entries are acked only after their batch
+# commits, and an entry redelivered after a crash finds its own row through
+# the unique (movie_id, user_id) index and the submission timestamp, so it
+# is reported as created rather than as a duplicate.
+#
+# Key layout:
+#   {prefix}:reviews:ingest                stream of pending submissions
+#   {prefix}:reviews:dlq                   dead-lettered submissions
+#   {prefix}:reviews:status:{id}           hash: state, user_id, movie_id, ...
+#   {prefix}:reviews:idem:{user}:{key}     ingest id for an Idempotency-Key
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from datetime import datetime
+import redis
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from app.database import open_session, upsert_insert
+from app.models import Movie, Review
+from app.rating_stats import apply_new_ratings
+from app.redis_client import r, CACHE_PREFIX, cache_stats, invalidate_tags, movie_reviews_tag
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REVIEW_WRITE_BEHIND = os.getenv("REVIEW_WRITE_BEHIND", "false").lower() == "true"
+# Run the inserter inside each API worker; turn off to run
+# `python -m app.review_ingest` as dedicated processes instead
+REVIEW_INGEST_IN_PROCESS = os.getenv("REVIEW_INGEST_IN_PROCESS", "true").lower() == "true"
+REVIEW_INGEST_BATCH_SIZE = int(os.getenv("REVIEW_INGEST_BATCH_SIZE", "500"))
+REVIEW_INGEST_BLOCK_MS = int(os.getenv("REVIEW_INGEST_BLOCK_MS", "1000"))
+# Entries a consumer has held this long without acking are taken over
+REVIEW_INGEST_CLAIM_IDLE_MS = int(os.getenv("REVIEW_INGEST_CLAIM_IDLE_MS", "30000"))
+# Failed inserts (constraint or data errors, not outages) before dead-lettering
+REVIEW_INGEST_MAX_ATTEMPTS = int(os.getenv("REVIEW_INGEST_MAX_ATTEMPTS", "5"))
+# Lifetime of status hashes and idempotency keys
+REVIEW_INGEST_STATUS_TTL = int(os.getenv("REVIEW_INGEST_STATUS_TTL", "86400"))
+
+STREAM_KEY = f"{CACHE_PREFIX}:reviews:ingest"
+DEAD_LETTER_KEY = f"{CACHE_PREFIX}:reviews:dlq"
+CONSUMER_GROUP = "review-inserters"
+_consumer_name = f"{socket.gethostname()}:{os.getpid()}"
+
+_DUPLICATE_DETAIL = "You have already reviewed this movie. Update your existing review instead."
+
+
+def _status_key(ingest_id: str) -> str:
+    return f"{CACHE_PREFIX}:reviews:status:{ingest_id}"
+
+def _idempotency_key(user_id, key: str) -> str:
+    return f"{CACHE_PREFIX}:reviews:idem:{user_id}:{key}"
+
+
+def enqueue_review(user_id: int, movie_id: int, rating: float, comment, idempotency_key=None):
+    """Queue a validated review; returns its status, or None if Redis is down.
+
+    A repeated Idempotency-Key from the same user returns the original
+    submission's status instead of queueing it again.
+    """
+    ingest_id = uuid.uuid4().hex
+    status = {"id": ingest_id, "state": "pending", "user_id": user_id, "movie_id": movie_id}
+    review = {
+        "user_id": user_id,
+        "movie_id": movie_id,
+        "rating": rating,
+        "comment": comment,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+    def queue(pipe):
+        pipe.hset(_status_key(ingest_id), mapping=status)
+        pipe.expire(_status_key(ingest_id), REVIEW_INGEST_STATUS_TTL)
+        pipe.xadd(STREAM_KEY, {"id": ingest_id, "review": json.dumps(review)})
+
+    try:
+        if not idempotency_key:
+            pipe = r.pipeline()
+            queue(pipe)
+            pipe.execute()
+            return status
+
+        idem_key = _idempotency_key(user_id, idempotency_key)
+
+        # The claim, status and stream entry commit in one MULTI watched on
+        # the claim: a concurrent retry either sees all three or starts over
+        def claim(pipe):
+            existing = pipe.get(idem_key)
+            previous = pipe.hgetall(_status_key(existing)) if existing else None
+            if previous:
+                return previous
+            pipe.multi()
+            pipe.set(idem_key, ingest_id, ex=REVIEW_INGEST_STATUS_TTL)
+            queue(pipe)
+            return status
+
+        return r.transaction(claim, idem_key, value_from_callable=True)
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis review enqueue error: {e}")
+        return None
+
+
+def get_ingest_status(ingest_id: str):
+    """The submission's status hash, or None if unknown or expired.
+
+    Raises redis.RedisError: callers cannot tell "unknown" from "unreachable".
+    """
+    try:
+        status = r.hgetall(_status_key(ingest_id))
+    except redis.RedisError as e:
+        cache_stats["redis_error"] += 1
+        print(f"Redis review status error: {e}")
+        raise
+    return status or None
+
+
+def ensure_consumer_group():
+    try:
+        r.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _read_entries(block_ms):
+    """Entries abandoned by a stalled consumer (or our own failed ones) first, then new ones."""
+    _, claimed, *_ = r.xautoclaim(
+        STREAM_KEY, CONSUMER_GROUP, _consumer_name,
+        min_idle_time=REVIEW_INGEST_CLAIM_IDLE_MS, start_id="0-0", count=REVIEW_INGEST_BATCH_SIZE,
+    )
+    # Redis 6.2 reports entries deleted while pending as nil
+    claimed = [(entry_id, fields) for entry_id, fields in claimed if fields]
+    if claimed:
+        return claimed
+    response = r.xreadgroup(
+        CONSUMER_GROUP, _consumer_name, {STREAM_KEY: ">"}, count=REVIEW_INGEST_BATCH_SIZE, block=block_ms
+    )
+    return response[0][1] if response else []
+
+
+def _parse_entry(fields) -> dict:
+    review = json.loads(fields["review"])
+    rating = float(review["rating"])
+    if rating < 0 or rating > 10:
+        raise ValueError(f"rating {rating} out of range")
+    return {
+        "ingest_id": fields["id"],
+        "user_id": int(review["user_id"]),
+        "movie_id": int(review["movie_id"]),
+        "rating": rating,
+        "comment": review["comment"],
+        "created_at": datetime.fromisoformat(review["created_at"]),
+    }
+
+
+def _rejected(status_code: int, detail: str) -> dict:
+    return {"state": "rejected", "status_code": status_code, "detail": detail}
+
+
+async def insert_reviews(db, reviews) -> dict:
+    """Insert a batch in one statement plus one stats upsert, and commit.
+
+    Returns ingest_id -> status fields for every review in the batch.
+    """
+    outcomes = {}
+    movie_ids = {review["movie_id"] for review in reviews}
+    movies = set((await db.scalars(select(Movie.id).where(Movie.id.in_(movie_ids)))).all())
+
+    rows = {}
+    for review in reviews:
+        key = (review["movie_id"], review["user_id"])
+        if review["movie_id"] not in movies:
+            outcomes[review["ingest_id"]] = _rejected(404, "Movie not found")
+        elif key in rows:
+            outcomes[review["ingest_id"]] = _rejected(400, _DUPLICATE_DETAIL)
+        else:
+            rows[key] = review
+    if not rows:
+        return outcomes
+
+    stmt = (
+        upsert_insert(db, Review.__table__)
+        .values([
+            {
+                "user_id": review["user_id"],
+                "movie_id": review["movie_id"],
+                "rating": review["rating"],
+                "comment": review["comment"],
+                "created_at": review["created_at"],
+                "updated_at": review["created_at"],
+            }
+            for review in rows.values()
+        ])
+        .on_conflict_do_nothing(index_elements=["movie_id", "user_id"])
+        .returning(Review.id, Review.movie_id, Review.user_id)
+    )
+    inserted = {(movie_id, user_id): review_id for review_id, movie_id, user_id in (await db.execute(stmt)).all()}
+
+    ratings_by_movie = defaultdict(list)
+    for key in inserted:
+        ratings_by_movie[key[0]].append(rows[key]["rating"])
+    await apply_new_ratings(db, ratings_by_movie)
+    await db.commit()
+    await run_in_threadpool(invalidate_tags, *(movie_reviews_tag(movie_id) for movie_id in ratings_by_movie))
+
+    conflicts = [key for key in rows if key not in inserted]
+    existing = {}
+    if conflicts:
+        # A redelivered entry whose batch already committed finds its own row
+        result = await db.execute(
+            select(Review.movie_id, Review.user_id, Review.id, Review.created_at)
+            .where(tuple_(Review.movie_id, Review.user_id).in_(conflicts))
+        )
+        existing = {(movie_id, user_id): (review_id, created_at) for movie_id, user_id, review_id, created_at in result}
+
+    for key, review in rows.items():
+        if key in inserted:
+            outcomes[review["ingest_id"]] = {"state": "created", "review_id": inserted[key]}
+        elif key in existing and existing[key][1] == review["created_at"]:
+            outcomes[review["ingest_id"]] = {"state": "created", "review_id": existing[key][0]}
+        else:
+            outcomes[review["ingest_id"]] = _rejected(400, _DUPLICATE_DETAIL)
+    return outcomes
+
+
+def _record_outcomes(entries, outcomes, failures, malformed):
+    """Write statuses and ack settled entries; count failed attempts, dead-letter the hopeless.
+
+    entries maps ingest_id -> (stream entry id, fields).
+    """
+    pipe = r.pipeline()
+    for ingest_id, _ in failures:
+        pipe.hincrby(_status_key(ingest_id), "attempts", 1)
+    attempts = pipe.execute()
+
+    dead = list(malformed)
+    for (ingest_id, error), count in zip(failures, attempts):
+        if count >= REVIEW_INGEST_MAX_ATTEMPTS:
+            dead.append((*entries[ingest_id], error))
+        else:
+            # Stays pending; _read_entries claims it again once it has idled
+            logger.warning(f"Review submission {ingest_id} failed (attempt {count}): {error}")
+
+    settled = [entries[ingest_id][0] for ingest_id in outcomes]
+    pipe = r.pipeline()
+    for ingest_id, status in outcomes.items():
+        pipe.hset(_status_key(ingest_id), mapping=status)
+        pipe.expire(_status_key(ingest_id), REVIEW_INGEST_STATUS_TTL)
+    for entry_id, fields, error in dead:
+        logger.error(f"Dead-lettering review submission {entry_id}: {error}")
+        pipe.xadd(DEAD_LETTER_KEY, {**fields, "error": error})
+        if "id" in fields:
+            pipe.hset(_status_key(fields["id"]), mapping={"state": "dead_lettered", "detail": error})
+            pipe.expire(_status_key(fields["id"]), REVIEW_INGEST_STATUS_TTL)
+        settled.append(entry_id)
+    if settled:
+        pipe.xack(STREAM_KEY, CONSUMER_GROUP, *settled)
+        pipe.xdel(STREAM_KEY, *settled)
+    pipe.execute()
+
+
+async def process_batch(session_factory=open_session, block_ms=REVIEW_INGEST_BLOCK_MS) -> int:
+    """Read up to one batch from the stream and settle it; returns entries read.
+
+    Database outages propagate with the entries left pending, so they are
+    retried rather than counted as failed attempts.
+    """
+    read = await run_in_threadpool(_read_entries, block_ms)
+    if not read:
+        return 0
+
+    entries, reviews, malformed = {}, [], []
+    for entry_id, fields in read:
+        try:
+            review = _parse_entry(fields)
+        except (KeyError, TypeError, ValueError) as e:
+            malformed.append((entry_id, fields, f"malformed submission: {e}"))
+            continue
+        entries[review["ingest_id"]] = (entry_id, fields)
+        reviews.append(review)
+
+    outcomes, failures = {}, []
+    if reviews:
+        try:
+            async with session_factory() as db:
+                outcomes.update(await insert_reviews(db, reviews))
+        except (OperationalError, InterfaceError):
+            raise
+        except SQLAlchemyError:
+            # Isolate the offending rows so the rest of the batch still lands
+            for review in reviews:
+                try:
+                    async with session_factory() as db:
+                        outcomes.update(await insert_reviews(db, [review]))
+                except (OperationalError, InterfaceError):
+                    raise
+                except SQLAlchemyError as e:
+                    failures.append((review["ingest_id"], str(getattr(e, "orig", None) or e)))
+
+    await run_in_threadpool(_record_outcomes, entries, outcomes, failures, malformed)
+    return len(read)
+
+
+async def run_review_inserter(session_factory=open_session):
+    """Background loop draining the ingest stream; safe to run in many processes."""
+    group_ready = False
+    while True:
+        try:
+            if not group_ready:
+                await run_in_threadpool(ensure_consumer_group)
+                group_ready = True
+            await process_batch(session_factory)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Review inserter batch failed: {e}")
+            group_ready = False
+            await asyncio.sleep(1)
+
+
+def requeue_dead_letters(count: int = 1000) -> int:
+    """Move dead-lettered submissions back onto the ingest stream."""
+    moved = 0
+    for entry_id, fields in r.xrange(DEAD_LETTER_KEY, count=count):
+        if "review" in fields:
+            pipe = r.pipeline()
+            pipe.xadd(STREAM_KEY, {"id": fields["id"], "review": fields["review"]})
+            pipe.hset(_status_key(fields["id"]), mapping={"state": "pending", "attempts": 0})
+            pipe.hdel(_status_key(fields["id"]), "detail")
+            pipe.xdel(DEAD_LETTER_KEY, entry_id)
+            pipe.execute()
+            moved += 1
+    return moved
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["--requeue-dead-letters"]:
+        print(f"Requeued {requeue_dead_letters()} dead-lettered reviews")
+    else:
+        print("Starting review inserter...")
+        asyncio.run(run_review_inserter())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, ConfigDict
-from typing import Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class UserCreate(BaseModel):
@@ -23,6 +23,9 @@ class UserOut(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class RoleUpdate(BaseModel):
+    role: Literal["user", "admin"]
+
 class Token(BaseModel):
     access_token: str
     refresh_token: str
@@ -34,6 +37,15 @@ class MovieCreate(BaseModel):
     genre: Optional[str] = None
     release_year: Optional[int] = None
 
+class MovieRatingStatsOut(BaseModel):
+    movie_id: int
+    review_count: int = 0
+    average_rating: Optional[float] = None
+    rating_sum: float = 0.0
+    histogram: List[int]
+
+    model_config = ConfigDict(from_attributes=True)
+
 class MovieResponse(BaseModel):
     id: int
     title: str
@@ -41,9 +53,14 @@ class MovieResponse(BaseModel):
     genre: Optional[str] = None
     release_year: Optional[int] = None
     created_at: datetime
+    rating_stats: Optional[MovieRatingStatsOut] = None
     
     model_config = ConfigDict(from_attributes=True)
 
+class MoviePage(BaseModel):
+    items: List[MovieResponse]
+    next_cursor: Optional[str] = None
+
 class ReviewCreate(BaseModel):
     rating: float
     comment: Optional[str] = None
@@ -58,10 +75,31 @@ class ReviewOut(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class ReviewPage(BaseModel):
+    items: List[ReviewOut]
+    next_cursor: Optional[str] = None
+
 class ReviewUpdate(BaseModel):
     rating: Optional[float] = None
     comment: Optional[str] = None
 
+class MovieReviewOut(ReviewOut):
+    username: Optional[str] = None
+
+class MovieDetail(MovieResponse):
+    # GET /movies/{id}?include=reviews: first page, continue with /movies/{id}/reviews?cursor=
+    reviews: Optional[List[MovieReviewOut]] = None
+    reviews_next_cursor: Optional[str] = None
+
+class ReviewIngestStatus(BaseModel):
+    # state: pending, created, rejected or dead_lettered
+    id: str
+    state: str
+    movie_id: Optional[int] = None
+    review_id: Optional[int] = None
+    status_code: Optional[int] = None
+    detail: Optional[str] = None
+
 class TokenResponse(BaseModel):
     access_token: str
     refresh_token: str
@@ -75,6 +113,15 @@ class MovieSearchResponse(BaseModel):
     description: str | None = None
     genre : str | None = None
     release_year: int | None = None
+    score: float | None = None
 
     class Config:
         from_attributes = True
+
+class MovieSearchPage(BaseModel):
+    items: List[MovieSearchResponse]
+    next_cursor: Optional[str] = None
+
+class MovieSuggestion(BaseModel):
+    id: int
+    title: str
@@ -1,30 +1,28 @@
 # A script to seed the database with initial movie data from a JSON file.
+# Goes through the same staging + upsert path as POST /movies/bulk.
 
-from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app.models import Movie
+import asyncio
 import json
+import os
+from app.database import open_session
+from app.bulk_ingest import bulk_upsert_movies, validate_movie
 
-def seed_movies():
-    db: Session = SessionLocal()
-    
-    with open("app/movies.json", "r", encoding="utf-8") as f:
-        movies_data = json.load(f)
-
-    for movie in movies_data:
-        exists = db.query(Movie).filter_by(title=movie["title"]).first()
-        if not exists:  
-            db.add(Movie(**movie))
+MOVIES_FILE = os.path.join(os.path.dirname(__file__), "movies.json")
 
-    db.commit()
-    db.close()
-
-
-if __name__ == "__main__":
-    seed_movies()
-    print("Seeding completed!")
+async def _rows(movies_data):
+    for line_no, movie in enumerate(movies_data, start=1):
+        yield validate_movie(line_no, movie)
 
+async def seed_movies(path: str = MOVIES_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        movies_data = json.load(f)
 
-    
+    async with open_session() as db:
+        upserted = await bulk_upsert_movies(db, _rows(movies_data))
+    return len(upserted)
 
 
+if __name__ == "__main__":
+    import sys
+    count = asyncio.run(seed_movies(*sys.argv[1:2]))
+    print(f"Seeding completed! {count} movies upserted")
@@ -0,0 +1,164 @@
+# In-process prefix index over movie titles for type-ahead suggestions.
+#
+# Titles are kept in a sorted array of (lowercased title, movie id) so a
+# prefix's matches are a bisected range, ranked by popularity. Broad prefixes
+# instead walk a second array in popularity order until enough titles match,
+# so the ranking is exact either way. Each worker holds its
+# own copy: it is loaded at startup, updated by the admin write paths, kept in
+# sync across workers through the cache invalidation channel, and fully
+# reloaded periodically to pick up popularity (review count) changes.
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+from bisect import bisect_left, insort
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models import Movie, MovieRatingStats
+from app.redis_client import publish_invalidation, register_invalidation_handler
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_MAX_RESULTS = 20
+# Prefixes matching more titles than this are served from the popularity
+# order rather than by ranking every match, so one-letter prefixes stay cheap
+SUGGEST_SCAN_LIMIT = int(os.getenv("SUGGEST_SCAN_LIMIT", "2000"))
+SUGGEST_REFRESH_SECONDS = int(os.getenv("SUGGEST_REFRESH_SECONDS", "600"))
+# Prefixes this short match so many titles that their ranked top-N is memoized
+SHORT_PREFIX_LENGTH = 2
+
+
+class TitlePrefixIndex:
+
+    def __init__(self):
+        self._entries = []
+        # (-popularity, lowercased title, movie id), most popular first
+        self._by_popularity = []
+        self._titles = {}
+        self._popularity = {}
+        self._short_prefix_cache = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """Replace the index with (movie_id, title, popularity) rows."""
+        titles = {}
+        popularity = {}
+        for movie_id, title, score in rows:
+            titles[movie_id] = title
+            popularity[movie_id] = score or 0
+        entries = sorted((title.lower(), movie_id) for movie_id, title in titles.items())
+        by_popularity = sorted((-popularity[movie_id], title_lower, movie_id) for title_lower, movie_id in entries)
+        with self._lock:
+            self._entries, self._by_popularity = entries, by_popularity
+            self._titles, self._popularity = titles, popularity
+            self._short_prefix_cache = {}
+
+    def upsert(self, movie_id: int, title: str):
+        with self._lock:
+            self._remove_locked(movie_id)
+            self._titles[movie_id] = title
+            self._popularity.setdefault(movie_id, 0)
+            insort(self._entries, (title.lower(), movie_id))
+            insort(self._by_popularity, self._rank_key(movie_id))
+            self._short_prefix_cache = {}
+
+    def remove(self, movie_id: int):
+        with self._lock:
+            self._remove_locked(movie_id)
+            self._popularity.pop(movie_id, None)
+            self._short_prefix_cache = {}
+
+    def _remove_locked(self, movie_id: int):
+        if movie_id not in self._titles:
+            return
+        for entries, entry in (
+            (self._entries, (self._titles[movie_id].lower(), movie_id)),
+            (self._by_popularity, self._rank_key(movie_id)),
+        ):
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+        del self._titles[movie_id]
+
+    def _rank_key(self, movie_id: int):
+        return (-self._popularity.get(movie_id, 0), self._titles[movie_id].lower(), movie_id)
+
+    def suggest(self, prefix: str, limit: int = 10):
+        prefix = prefix.lower()
+        if len(prefix) > SHORT_PREFIX_LENGTH:
+            return self._rank(prefix, limit)
+
+        # Bind the dict first: a concurrent update swaps in a fresh one, so a
+        # result ranked against the old titles is never stored in the new one
+        cache = self._short_prefix_cache
+        cached = cache.get(prefix)
+        if cached is None:
+            cached = self._rank(prefix, SUGGEST_MAX_RESULTS)
+            cache[prefix] = cached
+        return cached[:limit]
+
+    def _rank(self, prefix: str, limit: int):
+        with self._lock:
+            entries = self._entries
+            start = bisect_left(entries, (prefix,))
+            # First title past every one starting with prefix
+            end = bisect_left(entries, (prefix[:-1] + chr(min(ord(prefix[-1]) + 1, 0x10FFFF)),))
+            if end - start <= SUGGEST_SCAN_LIMIT:
+                matches = (movie_id for _, movie_id in entries[start:end])
+                top = heapq.nsmallest(limit, matches, key=self._rank_key)
+            else:
+                # At least SUGGEST_SCAN_LIMIT titles match, so the most
+                # popular matches turn up early in popularity order
+                matches = (movie_id for _, title_lower, movie_id in self._by_popularity if title_lower.startswith(prefix))
+                top = list(itertools.islice(matches, limit))
+            return [{"id": movie_id, "title": self._titles[movie_id]} for movie_id in top]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+title_index = TitlePrefixIndex()
+
+
+def reload_title_index():
+    db: Session = SessionLocal()
+    try:
+        rows = db.execute(
+            select(Movie.id, Movie.title, func.coalesce(MovieRatingStats.review_count, 0))
+            .outerjoin(MovieRatingStats, MovieRatingStats.movie_id == Movie.id)
+        ).all()
+        title_index.load(rows)
+        logger.info(f"Loaded {len(rows)} titles into the suggestion index")
+    except Exception as e:
+        logger.error(f"Error loading suggestion index: {e}")
+    finally:
+        db.close()
+
+
+def title_changed(movie_id: int, title: str | None):
+    """Apply a title change locally and broadcast it to the other workers."""
+    if title is None:
+        title_index.remove(movie_id)
+    else:
+        title_index.upsert(movie_id, title)
+    publish_invalidation({"op": "title", "movie_id": movie_id, "title": title})
+
+
+def titles_reloaded():
+    """Rebuild the index after a bulk change and tell other workers to do the same."""
+    reload_title_index()
+    publish_invalidation({"op": "title_reload"})
+
+
+def _apply_title_message(message: dict):
+    if message.get("title") is None:
+        title_index.remove(message["movie_id"])
+    else:
+        title_index.upsert(message["movie_id"], message["title"])
+
+
+register_invalidation_handler("title", _apply_title_message)
+register_invalidation_handler("title_reload", lambda message: reload_title_index())
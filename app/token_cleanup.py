@@ -1,34 +1,51 @@
-
 from datetime import datetime
+from sqlalchemy import case, delete, func, select
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from app.database import SessionLocal
 from app.models import RefreshToken
+from app.redis_client import acquire_lock
+import asyncio
 import logging
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rows deleted per statement/transaction, so no cleanup holds long locks
+TOKEN_CLEANUP_BATCH_SIZE = int(os.getenv("TOKEN_CLEANUP_BATCH_SIZE", "5000"))
+# How often the background reaper runs; 0 disables it
+TOKEN_REAPER_INTERVAL_SECONDS = int(os.getenv("TOKEN_REAPER_INTERVAL_SECONDS", "3600"))
+
+def _delete_in_batches(db: Session, condition) -> int:
+    """Set-based DELETE of matching tokens, one bounded chunk per commit."""
+    total = 0
+    while True:
+        batch = select(RefreshToken.id).where(condition).limit(TOKEN_CLEANUP_BATCH_SIZE)
+        result = db.execute(
+            delete(RefreshToken)
+            .where(RefreshToken.id.in_(batch.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        total += result.rowcount
+        if result.rowcount < TOKEN_CLEANUP_BATCH_SIZE:
+            return total
+
 def cleanup_expired_tokens():
-  
+
     db: Session = SessionLocal()
     try:
         current_time = datetime.utcnow()
 
-        expired_tokens = db.query(RefreshToken).filter(
-            RefreshToken.expires_at < current_time
-        ).all()
-        
-        if expired_tokens:
-            for token in expired_tokens:
-                db.delete(token)
-            
-            db.commit()
-            logger.info(f"Cleaned up {len(expired_tokens)} expired refresh tokens")
-            return len(expired_tokens)
+        removed = _delete_in_batches(db, RefreshToken.expires_at < current_time)
+
+        if removed:
+            logger.info(f"Cleaned up {removed} expired refresh tokens")
         else:
             logger.info("No expired tokens found")
-            return 0
-            
+        return removed
+
     except Exception as e:
         logger.error(f"Error during token cleanup: {e}")
         db.rollback()
@@ -40,21 +57,14 @@ def cleanup_revoked_tokens():
 
     db: Session = SessionLocal()
     try:
-        revoked_tokens = db.query(RefreshToken).filter(
-            RefreshToken.revoked == True
-        ).all()
-        
-        if revoked_tokens:
-            for token in revoked_tokens:
-                db.delete(token)
-            
-            db.commit()
-            logger.info(f"Cleaned up {len(revoked_tokens)} revoked refresh tokens")
-            return len(revoked_tokens)
+        removed = _delete_in_batches(db, RefreshToken.revoked == True)
+
+        if removed:
+            logger.info(f"Cleaned up {removed} revoked refresh tokens")
         else:
             logger.info("No revoked tokens found")
-            return 0
-            
+        return removed
+
     except Exception as e:
         logger.error(f"Error during revoked token cleanup: {e}")
         db.rollback()
@@ -67,38 +77,58 @@ def get_token_stats():
     db: Session = SessionLocal()
     try:
         current_time = datetime.utcnow()
-        
-        total_tokens = db.query(RefreshToken).count()
-        expired_tokens = db.query(RefreshToken).filter(
-            RefreshToken.expires_at < current_time
-        ).count()
-        revoked_tokens = db.query(RefreshToken).filter(
-            RefreshToken.revoked == True
-        ).count()
-        active_tokens = total_tokens - expired_tokens - revoked_tokens
-        
+        expired = RefreshToken.expires_at < current_time
+        revoked = RefreshToken.revoked == True
+
+        # One pass over the table instead of a COUNT per bucket
+        total_tokens, expired_tokens, revoked_tokens, active_tokens = db.execute(
+            select(
+                func.count(RefreshToken.id),
+                func.count(case((expired, 1))),
+                func.count(case((revoked, 1))),
+                func.count(case((~expired & (func.coalesce(RefreshToken.revoked, False) == False), 1))),
+            )
+        ).one()
+
         stats = {
             "total_tokens": total_tokens,
             "active_tokens": active_tokens,
             "expired_tokens": expired_tokens,
             "revoked_tokens": revoked_tokens
         }
-        
+
         logger.info(f"Token statistics: {stats}")
         return stats
-        
+
     except Exception as e:
         logger.error(f"Error getting token stats: {e}")
         return None
     finally:
         db.close()
 
+async def run_token_reaper():
+    """Background loop: purge expired/revoked tokens once per interval, fleet-wide.
+
+    The lock is left to expire rather than released, so however many workers
+    wake up during an interval, only the first one does the work.
+    """
+    while True:
+        await asyncio.sleep(TOKEN_REAPER_INTERVAL_SECONDS)
+        lock_ttl_ms = int(TOKEN_REAPER_INTERVAL_SECONDS * 1000 * 0.9)
+        if await run_in_threadpool(acquire_lock, "token-reaper", lock_ttl_ms) is None:
+            continue
+        try:
+            await run_in_threadpool(cleanup_expired_tokens)
+            await run_in_threadpool(cleanup_revoked_tokens)
+        except Exception as e:
+            logger.error(f"Token reaper run failed: {e}")
+
 if __name__ == "__main__":
     print("Starting token cleanup...")
     expired_count = cleanup_expired_tokens()
     revoked_count = cleanup_revoked_tokens()
     stats = get_token_stats()
-    
+
     print(f"Cleanup completed:")
     print(f"- Expired tokens removed: {expired_count}")
     print(f"- Revoked tokens removed: {revoked_count}")
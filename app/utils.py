@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta
+import hashlib
+import uuid
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from os import getenv
@@ -14,7 +16,10 @@ ALGORITHM = "HS256"
 
 ACCESS_TOKEN_EXPIRE_MINUTES = int(getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Raising this makes existing hashes get upgraded on their owner's next login
+BCRYPT_ROUNDS = int(getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def hash_password(password: str):
     return pwd_context.hash(password)
@@ -22,6 +27,9 @@ def hash_password(password: str):
 def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -30,18 +38,25 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def decode_access_token(token: str):
+    payload = decode_access_token_claims(token)
+    if payload is None:
+        return None
+    return payload.get("sub")
+
+def decode_access_token_claims(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
-        user_id  = payload.get("sub")
-
-        if user_id is None:
+        if payload.get("sub") is None:
             return None
             
-        return user_id
+        return payload
         
     except JWTError:
         return None
+
+def access_token_claims(user) -> dict:
+    return {"sub": str(user.id), "role": user.role, "tv": user.token_version}
     
 
 REFRESH_TOKEN_EXPIRE_DAYS = int(getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
@@ -49,7 +64,8 @@ REFRESH_TOKEN_EXPIRE_DAYS = int(getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 def create_refresh_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
-    to_encode.update({"exp": expire})
+    # jti keeps two tokens minted in the same second for one user distinct
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
 
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -63,5 +79,5 @@ def decode_refresh_token(token: str):
     except JWTError:
         return None
 
-
-
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -0,0 +1,66 @@
+# Micro-benchmark: default vs FAST_JSON_RESPONSES serialization of a list page.
+#
+#   python -m benchmarks.bench_serialization [rows] [iterations]
+#
+# Both paths start from what the database hands back (ORM objects vs column
+# tuples) and end at response bytes; the bodies are checked to be identical.
+
+import os
+import sys
+import timeit
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from app.fast_json import ORJSONBody, row_serializer, schema_columns
+from app.models import Base, Movie
+from app.schemas import MovieResponse
+
+
+def main(rows: int = 100, iterations: int = 2000):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.execute(insert(Movie), [
+            {
+                "title": f"Movie {i}",
+                "description": "An epic tale of friendship and betrayal " * 3,
+                "genre": "Drama",
+                "release_year": 1990 + i % 30,
+                "created_at": datetime(2024, 1, 1, 12, i % 60, 0, 123456),
+            }
+            for i in range(rows)
+        ])
+        db.commit()
+        objects = db.scalars(select(Movie)).all()
+        columns = schema_columns(MovieResponse, Movie)
+        tuples = db.execute(select(*columns)).all()
+
+    # What FastAPI does for response_model=List[MovieResponse]
+    adapter = TypeAdapter(list[MovieResponse])
+
+    def default_path():
+        validated = adapter.validate_python(objects, from_attributes=True)
+        return JSONResponse(adapter.dump_python(validated, mode="json")).body
+
+    serialize = row_serializer(MovieResponse, columns)
+
+    def fast_path():
+        return ORJSONBody([serialize(row) for row in tuples]).body
+
+    assert default_path() == fast_path(), "fast path must produce identical bodies"
+
+    default_s = min(timeit.repeat(default_path, number=iterations, repeat=3)) / iterations
+    fast_s = min(timeit.repeat(fast_path, number=iterations, repeat=3)) / iterations
+    print(f"{rows}-row page, best of 3 x {iterations}")
+    print(f"  default (pydantic from_attributes + json): {default_s * 1e6:9.1f} us")
+    print(f"  fast    (column tuples + orjson):          {fast_s * 1e6:9.1f} us")
+    print(f"  speedup: {default_s / fast_s:.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
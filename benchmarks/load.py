@@ -0,0 +1,471 @@
+# HTTP load and latency benchmark.
+#
+#   python -m benchmarks.load --size small --fake-redis               # SQLite file, in-process
+#   python -m benchmarks.load --database-url postgresql://... --size large
+#   python -m benchmarks.load --base-url http://localhost:8000 --skip-seed
+#   python -m benchmarks.load --compare benchmarks/results/<earlier>.json
+#
+# Seeds a deterministic dataset, then drives a weighted mix of routes from
+# --concurrency workers and reports req/s, p50/p95/p99 and SQL statements
+# per request (from the Server-Timing header) for each operation. Results are written as JSON
+# so runs from different commits can be compared with --compare.
+#
+# In-process mode serves the app through httpx's ASGI transport, so no server
+# or network sits in between. Against Postgres the schema must already be
+# migrated (alembic upgrade head); on SQLite tables are created here and
+# search is left out of the mix (it needs Postgres full-text and pg_trgm).
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import re
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+SIZES = {
+    "small": {"movies": 10_000, "reviews": 50_000, "users": 1_000},
+    "large": {"movies": 1_000_000, "reviews": 1_000_000, "users": 10_000},
+}
+DEFAULT_MIX = "movies=35,reviews=30,search=15,login=5,write=15"
+BENCH_PASSWORD = "bench-password"
+# Never the app's DATABASE_URL: seeding deletes every user, movie and review
+BENCH_DATABASE_URL = "sqlite:///benchmarks/bench.db"
+# Seeded accounts use this email domain; it marks a database as ours to reseed
+BENCH_EMAIL_DOMAIN = "bench.local"
+SEED_BATCH_SIZE = 10_000
+
+ADJECTIVES = ["silent", "crimson", "lost", "golden", "broken", "last", "hidden", "eternal", "wild", "dark"]
+NOUNS = ["river", "empire", "garden", "storm", "kingdom", "shadow", "voyage", "promise", "city", "dream"]
+GENRES = ["Action", "Drama", "Comedy", "Thriller", "Romance", "Sci-Fi", "Fantasy", "Horror"]
+
+_SERVER_TIMING_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP load and latency benchmark")
+    parser.add_argument("--database-url", default=BENCH_DATABASE_URL, help=f"Benchmark database (default: {BENCH_DATABASE_URL})")
+    parser.add_argument("--base-url", help="Benchmark a running server instead of the app in-process")
+    parser.add_argument("--fake-redis", action="store_true", help="Use fakeredis in place of a Redis server (in-process only)")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--movies", type=int)
+    parser.add_argument("--reviews", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the dataset from an earlier run")
+    parser.add_argument(
+        "--reset", action="store_true",
+        help="Seed even a non-empty database this benchmark did not create, deleting its users, movies and reviews",
+    )
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted operations (default: {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run (after warm-up)")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to diff against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent for --compare")
+    args = parser.parse_args(argv)
+
+    for key, value in SIZES[args.size].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    args.writers = max(1, math.ceil(args.concurrency * 4))
+    return args
+
+
+def _dataset_rows(args):
+    rng = random.Random(args.seed)
+    created = datetime(2024, 1, 1)
+    movies = (
+        {
+            "title": f"{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {i}",
+            "description": " ".join(rng.choice(ADJECTIVES + NOUNS) for _ in range(12)),
+            "genre": rng.choice(GENRES),
+            "release_year": rng.randint(1950, 2024),
+            "created_at": created + timedelta(seconds=i),
+        }
+        for i in range(args.movies)
+    )
+    return movies
+
+
+def _batched(rows, size=SEED_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _refuse_foreign_database(conn):
+    """Exit unless the database is empty or holds only an earlier benchmark dataset."""
+    from sqlalchemy import func, select
+    from app.models import Movie, User
+
+    bench_user = User.email.like(f"%@{BENCH_EMAIL_DOMAIN}")
+    users, bench_users = conn.execute(
+        select(func.count(User.id), func.count(User.id).filter(bench_user))
+    ).one()
+    if (bench_users and users == bench_users) or not (users or conn.scalar(select(func.count(Movie.id)))):
+        return
+    sys.exit(
+        f"{conn.engine.url.render_as_string(hide_password=True)} has data this benchmark did not seed; "
+        "seeding would delete it. Pass --reset to wipe it anyway, or --skip-seed."
+    )
+
+
+def seed(args):
+    """Replace the benchmark tables' contents with a deterministic dataset.
+
+    Refuses (without --reset) a non-empty database it did not seed itself.
+    """
+    from sqlalchemy import delete, insert, select
+    from app.database import engine
+    from app.models import Base, Movie, MovieRatingStats, RefreshToken, Review, User
+    from app.rating_stats import rebuild_rating_stats
+    from app.utils import hash_password
+
+    if args.users * args.movies < args.reviews:
+        sys.exit("--reviews cannot exceed --users x --movies (one review per user and movie)")
+
+    if engine.dialect.name == "sqlite":
+        Base.metadata.create_all(engine)
+
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    password_hash = hash_password(BENCH_PASSWORD)
+    created = datetime(2024, 1, 1)
+
+    with engine.begin() as conn:
+        if not args.reset:
+            _refuse_foreign_database(conn)
+        for model in (Review, MovieRatingStats, RefreshToken, Movie, User):
+            conn.execute(delete(model))
+
+    with engine.begin() as conn:
+        users = (
+            {
+                "username": f"{kind}{i}",
+                "email": f"{kind}{i}@{BENCH_EMAIL_DOMAIN}",
+                "password_hash": password_hash,
+                "role": "user",
+                "created_at": created,
+            }
+            for kind, count in (("bench", args.users), ("writer", args.writers))
+            for i in range(count)
+        )
+        for batch in _batched(users):
+            conn.execute(insert(User), batch)
+        for batch in _batched(_dataset_rows(args)):
+            conn.execute(insert(Movie), batch)
+
+        user_ids = conn.scalars(select(User.id).where(User.username.like("bench%")).order_by(User.id)).all()
+        movie_ids = conn.scalars(select(Movie.id).order_by(Movie.id)).all()
+
+        # User u reviews movies stride*u, stride*u + 1, ...: distinct pairs,
+        # spread across the whole catalog
+        stride = max(1, len(movie_ids) // len(user_ids))
+        reviews = (
+            {
+                "user_id": user_ids[i % len(user_ids)],
+                "movie_id": movie_ids[(i // len(user_ids) + (i % len(user_ids)) * stride) % len(movie_ids)],
+                "rating": float(rng.randint(0, 10)),
+                "comment": " ".join(rng.choice(ADJECTIVES + NOUNS) for _ in range(8)),
+                "created_at": created + timedelta(seconds=i),
+            }
+            for i in range(args.reviews)
+        )
+        for batch in _batched(reviews):
+            conn.execute(insert(Review), batch)
+
+    rebuild_rating_stats()
+    print(
+        f"Seeded {args.movies} movies, {args.reviews} reviews, {args.users + args.writers} users "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def _load_fixtures(args):
+    """Ids and tokens the workload needs, read back from the database."""
+    from sqlalchemy import func, select
+    from app.database import engine
+    from app.models import Movie, Review, User
+    from app.utils import access_token_claims, create_access_token
+
+    with engine.connect() as conn:
+        movie_ids = conn.scalars(select(Movie.id).order_by(Movie.id)).all()
+        writers = conn.execute(
+            select(User.id, User.role, User.token_version).where(User.username.like("writer%")).order_by(User.id)
+        ).all()
+        login_users = conn.scalar(select(func.count(User.id)).where(User.username.like("bench%")))
+        review_count = conn.scalar(select(func.count(Review.id)))
+        # Writes from earlier --skip-seed runs; new ones continue after them
+        written = conn.scalar(
+            select(func.count(Review.id)).join(User, User.id == Review.user_id).where(User.username.like("writer%"))
+        )
+
+    if not movie_ids or not writers:
+        sys.exit("No benchmark dataset found; run without --skip-seed first")
+
+    return {
+        "movie_ids": movie_ids,
+        "writer_tokens": [create_access_token(data=access_token_claims(w)) for w in writers],
+        "login_users": login_users,
+        "review_count": review_count,
+        "written": written,
+        "dialect": engine.dialect.name,
+    }
+
+
+def _build_operations(fixtures):
+    from app.pagination import encode_cursor
+
+    movie_ids = fixtures["movie_ids"]
+    tokens = fixtures["writer_tokens"]
+    # Writer w reviews movies in order, so every write is a fresh (user, movie)
+    # pair until all of them are used up
+    write_counter = itertools.count(fixtures["written"])
+
+    def hot_movie(rng):
+        # Skewed towards low ids: a few titles get most of the traffic
+        return movie_ids[int(len(movie_ids) * rng.random() ** 3)]
+
+    def movies(rng):
+        if rng.random() < 0.3:
+            return "GET", "/movies/?cursor=&limit=50", {}
+        return "GET", f"/movies/?cursor={encode_cursor(rng.choice(movie_ids))}&limit=50", {}
+
+    def reviews(rng):
+        return "GET", f"/movies/{hot_movie(rng)}/reviews?cursor=&limit=20", {}
+
+    def search(rng):
+        term = rng.choice(ADJECTIVES + NOUNS)
+        if rng.random() < 0.3:
+            term += f" {rng.choice(NOUNS)}"
+        return "GET", "/search/", {"params": {"q": term}}
+
+    def login(rng):
+        return "POST", "/auth/login", {
+            "data": {"username": f"bench{rng.randrange(fixtures['login_users'])}", "password": BENCH_PASSWORD}
+        }
+
+    def write(rng):
+        k = next(write_counter) % (len(tokens) * len(movie_ids))
+        return "POST", f"/movies/{movie_ids[k % len(movie_ids)]}/reviews", {
+            "json": {"rating": rng.randint(0, 10), "comment": "benchmark review"},
+            "headers": {"Authorization": f"Bearer {tokens[k // len(movie_ids)]}"},
+        }
+
+    return {"movies": movies, "reviews": reviews, "search": search, "login": login, "write": write}
+
+
+def _parse_mix(mix: str, dialect: str):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight)
+    if dialect == "sqlite" and weights.pop("search", None):
+        print("Leaving search out of the mix: it needs Postgres")
+    return weights
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _summarize(latencies, statuses, queries, elapsed):
+    results = {}
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        count = len(values)
+        results[op] = {
+            "requests": count,
+            "errors": sum(n for code, n in statuses[op].items() if code >= 400),
+            "statuses": {str(code): n for code, n in sorted(statuses[op].items())},
+            "rps": round(count / elapsed, 2),
+            "mean_ms": round(sum(values) / count * 1000, 3),
+            "p50_ms": round(_percentile(values, 50) * 1000, 3),
+            "p95_ms": round(_percentile(values, 95) * 1000, 3),
+            "p99_ms": round(_percentile(values, 99) * 1000, 3),
+            "queries_per_request": round(sum(queries[op]) / len(queries[op]), 2) if queries[op] else None,
+        }
+    all_values = sorted(v for values in latencies.values() for v in values)
+    total = len(all_values)
+    results["total"] = {
+        "requests": total,
+        "errors": sum(r["errors"] for r in results.values()),
+        "rps": round(total / elapsed, 2),
+        "p50_ms": round(_percentile(all_values, 50) * 1000, 3) if total else None,
+        "p95_ms": round(_percentile(all_values, 95) * 1000, 3) if total else None,
+        "p99_ms": round(_percentile(all_values, 99) * 1000, 3) if total else None,
+    }
+    return results
+
+
+async def _drive(client, operations, weights, args):
+    names = list(weights)
+    cumulative = list(weights.values())
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    queries = defaultdict(list)
+    recording = False
+    stop_at = time.perf_counter() + args.warmup + args.duration
+
+    async def worker(worker_id):
+        rng = random.Random(args.seed * 1000 + worker_id)
+        while time.perf_counter() < stop_at:
+            op = rng.choices(names, cumulative)[0]
+            method, url, kwargs = operations[op](rng)
+            # Requests straddling the end of warm-up are left out entirely
+            measured = recording
+            started = time.perf_counter()
+            response = None
+            try:
+                response = await client.request(method, url, **kwargs)
+                code = response.status_code
+            except Exception as e:
+                print(f"{op} request failed: {e}")
+                code = 599
+            if measured:
+                latencies[op].append(time.perf_counter() - started)
+                statuses[op][code] += 1
+                timing = _SERVER_TIMING_QUERIES.search(response.headers.get("server-timing", "")) if response else None
+                if timing:
+                    queries[op].append(int(timing.group(1)))
+
+    workers = [asyncio.create_task(worker(i)) for i in range(args.concurrency)]
+    await asyncio.sleep(args.warmup)
+    recording = True
+    measured_from = time.perf_counter()
+    await asyncio.gather(*workers)
+    return latencies, statuses, queries, time.perf_counter() - measured_from
+
+
+async def run(args, weights, operations):
+    import httpx
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+            return _summarize(*await _drive(client, operations, weights, args))
+
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            return _summarize(*await _drive(client, operations, weights, args))
+
+
+def _git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _print_results(results):
+    print(f"{'operation':<10} {'req':>8} {'err':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'q/req':>6}")
+    for op, r in results.items():
+        qpr = r.get("queries_per_request")
+        print(
+            f"{op:<10} {r['requests']:>8} {r['errors']:>6} {r['rps']:>9.1f} "
+            f"{r['p50_ms'] or 0:>9.2f} {r['p95_ms'] or 0:>9.2f} {r['p99_ms'] or 0:>9.2f} "
+            f"{'' if qpr is None else qpr:>6}"
+        )
+
+
+def compare(baseline_path, current, threshold):
+    """Print per-operation deltas; returns True if anything regressed past threshold."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline['meta']['commit']} ({baseline_path})")
+    for key in ("target", "database", "fake_redis", "dataset", "mix", "concurrency"):
+        if baseline["meta"].get(key) != current["meta"][key]:
+            print(f"warning: {key} differs ({baseline['meta'].get(key)} -> {current['meta'][key]}); numbers are not comparable")
+    regressed = False
+    for op, now in current["results"].items():
+        before = baseline["results"].get(op)
+        if not before:
+            continue
+        rps_delta = (now["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+        p95_delta = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        flag = rps_delta < -threshold or p95_delta > threshold
+        regressed |= flag
+        print(f"{op:<10} req/s {rps_delta:+7.1f}%   p95 {p95_delta:+7.1f}%{'   REGRESSION' if flag else ''}")
+    return regressed
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    os.environ["DATABASE_URL"] = args.database_url
+    if not args.base_url:
+        # A remote server needs the real key so our minted tokens verify
+        os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+    if args.fake_redis:
+        if args.base_url:
+            sys.exit("--fake-redis only applies to in-process runs")
+        import fakeredis
+        import redis
+        # Must happen before app.redis_client creates its client
+        redis.Redis = fakeredis.FakeRedis
+
+    if not args.skip_seed:
+        seed(args)
+
+    fixtures = _load_fixtures(args)
+    weights = _parse_mix(args.mix, fixtures["dialect"])
+    operations = _build_operations(fixtures)
+
+    results = asyncio.run(run(args, weights, operations))
+    report = {
+        "meta": {
+            "commit": _git_revision(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "target": args.base_url or "in-process",
+            "database": fixtures["dialect"],
+            "fake_redis": args.fake_redis,
+            "dataset": {
+                "movies": len(fixtures["movie_ids"]),
+                "reviews": fixtures["review_count"],
+                "users": fixtures["login_users"],
+            },
+            "mix": weights,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    _print_results(results)
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"{datetime.utcnow():%Y%m%dT%H%M%S}-{report['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare and compare(args.compare, report, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from app.models import User, RefreshToken
-from app.schemas import UserCreate, UserOut, Token, TokenRequest, TokenResponse
+from app.schemas import UserCreate, UserOut, Token, TokenRequest, TokenResponse, RoleUpdate
 from app.database import get_db
-from app.utils import hash_password, verify_password, create_access_token, create_refresh_token, decode_refresh_token
+from app.utils import create_access_token, create_refresh_token, decode_refresh_token, access_token_claims, hash_refresh_token, REFRESH_TOKEN_EXPIRE_DAYS
 from app.token_cleanup import cleanup_expired_tokens, cleanup_revoked_tokens, get_token_stats
-from app.dependencies import get_current_user, require_role
+from app.dependencies import AuthenticatedUser, get_current_user, require_role
+from app.auth_state import bump_token_version, mark_refresh_tokens_revoked, is_refresh_token_revoked
+from app.password_pool import hash_password_async, verify_password_async
 
 router = APIRouter()
 
 @router.post('/register', response_model=UserOut, status_code=status.HTTP_201_CREATED)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await db.scalar(select(User.id).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    db_user = db.query(User).filter(User.username == user.username).first()
+    db_user = await db.scalar(select(User.id).where(User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Username already taken")
     
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password_async(user.password)
     new_user = User(
         username=user.username,
         email=user.email,
@@ -29,32 +34,40 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
 @router.post('/login', response_model=Token)
-def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
 
-   user = db.query(User).filter(User.username == form_data.username).first()
+   user = await db.scalar(select(User).where(User.username == form_data.username))
 
-   if not user or not verify_password(form_data.password, user.password_hash):
+   is_valid, new_hash = False, None
+   if user:
+       is_valid, new_hash = await verify_password_async(form_data.password, user.password_hash)
+
+   if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )   
 
-   access_token = create_access_token(data={"sub": str(user.id)})
+   # Cost or scheme changed since this hash was made; upgrade it transparently
+   if new_hash:
+       user.password_hash = new_hash
+
+   access_token = create_access_token(data=access_token_claims(user))
    refresh_token = create_refresh_token(data={"sub": str(user.id)})
 
    db_refresh_token = RefreshToken(
        user_id=user.id,
-       token=refresh_token
+       token_hash=hash_refresh_token(refresh_token)
    )
    db.add(db_refresh_token)
-   db.commit()
+   await db.commit()
 
    return {
         "access_token": access_token, 
@@ -64,48 +77,111 @@ def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = D
 
 
 @router.post("/refresh", response_model=TokenResponse)
-def refresh_token_endpoint(request: TokenRequest, db: Session = Depends(get_db)):
+async def refresh_token_endpoint(request: TokenRequest, db: AsyncSession = Depends(get_db)):
 
     token_str = request.refresh_token
 
-    token_in_db = db.query(RefreshToken).filter_by(token=token_str).first()
-    if not token_in_db:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
-
-    try:
-        payload = decode_refresh_token(token_str)
-        user_id = payload.get("sub")
-    except Exception:
+    user_id = decode_refresh_token(token_str)
+    if user_id is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired refresh token")
 
-    user = db.query(User).filter_by(id=user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    # Replayed (already rotated) or logged-out tokens are rejected from Redis
+    # without a database round trip
+    old_hash = hash_refresh_token(token_str)
+    if await run_in_threadpool(is_refresh_token_revoked, old_hash):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    new_access_token = create_access_token({"sub": str(user.id)})
-    new_refresh_token = create_refresh_token({"sub": str(user.id)})
+    new_refresh_token = create_refresh_token({"sub": str(user_id)})
+    new_expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+
+    # Validate and rotate in one statement on the digest index; the WHERE
+    # makes rotation atomic, so a token can be exchanged at most once.
+    # RETURNING also carries the access-token claims, so a valid refresh
+    # is this one round trip plus the commit.
+    claim = lambda column: select(column).where(User.id == RefreshToken.user_id).scalar_subquery()
+    rotated = (await db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == old_hash,
+            RefreshToken.user_id == int(user_id),
+            func.coalesce(RefreshToken.revoked, False) == False,
+            RefreshToken.expires_at > datetime.utcnow(),
+        )
+        .values(token_hash=hash_refresh_token(new_refresh_token), expires_at=new_expires_at)
+        .returning(
+            RefreshToken.user_id.label("id"),
+            claim(User.role).label("role"),
+            claim(User.token_version).label("token_version"),
+        )
+    )).first()
+    if rotated is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    if rotated.token_version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    # Built from the returned row, not an ORM object the commit would expire
+    new_access_token = create_access_token(access_token_claims(rotated))
+    await db.commit()
 
-    token_in_db.token = new_refresh_token
-    db.commit()
+    await run_in_threadpool(mark_refresh_tokens_revoked, [(old_hash, new_expires_at)])
 
     return {"access_token": new_access_token, "refresh_token": new_refresh_token}
     
 
 @router.post("/auth/logout")
-def logout_user(request: TokenRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def logout_user(request: TokenRequest, db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_user)):
 
-    token_in_db = db.query(RefreshToken).filter_by(token=request.refresh_token).first()
+    revoked = (await db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == hash_refresh_token(request.refresh_token),
+            RefreshToken.user_id == current_user.id,
+        )
+        .values(revoked=True)
+        .returning(RefreshToken.token_hash, RefreshToken.expires_at)
+    )).all()
+    if not revoked:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    await db.commit()
 
-    token_in_db.revoked = True
-    db.commit()
+    await run_in_threadpool(mark_refresh_tokens_revoked, revoked)
     return {"message": "Logged out successfully"}
 
+@router.post("/logout-all")
+async def logout_all_sessions(db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_user)):
+
+    revoked = (await db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.user_id == current_user.id,
+            func.coalesce(RefreshToken.revoked, False) == False,
+        )
+        .values(revoked=True)
+        .returning(RefreshToken.token_hash, RefreshToken.expires_at)
+    )).all()
+    # Commits the revocations too and kills every outstanding access token
+    await bump_token_version(db, current_user.id)
+
+    await run_in_threadpool(mark_refresh_tokens_revoked, revoked)
+    return {"message": "Logged out of all sessions"}
+
+@router.put("/users/{user_id}/role", response_model=UserOut)
+async def update_user_role(
+    user_id: int,
+    role_in: RoleUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(require_role("admin")),
+):
+    # Tokens carry the role, so changing it must invalidate them
+    if await bump_token_version(db, user_id, role=role_in.role) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await db.get(User, user_id, populate_existing=True)
+
 @router.post("/auth/cleanup-tokens")
-def cleanup_tokens_endpoint(current_user: User = Depends(require_role("admin"))):
+async def cleanup_tokens_endpoint(current_user: AuthenticatedUser = Depends(require_role("admin"))):
     try:
-        expired_count = cleanup_expired_tokens()
-        revoked_count = cleanup_revoked_tokens()
-        stats = get_token_stats()
+        expired_count = await run_in_threadpool(cleanup_expired_tokens)
+        revoked_count = await run_in_threadpool(cleanup_revoked_tokens)
+        stats = await run_in_threadpool(get_token_stats)
         
         return {
             "message": "Token cleanup completed successfully",
@@ -120,10 +196,10 @@ def cleanup_tokens_endpoint(current_user: User = Depends(require_role("admin")))
         )
 
 @router.get("/auth/token-stats")
-def get_token_statistics(current_user: User = Depends(require_role("admin"))):
+async def get_token_statistics(current_user: AuthenticatedUser = Depends(require_role("admin"))):
   
     try:
-        stats = get_token_stats()
+        stats = await run_in_threadpool(get_token_stats)
         if stats is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,26 +1,204 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.models import Movie
-from app.schemas import MovieResponse
-from app.database import get_db
-from sqlalchemy import func
+from typing import List, Optional, Union
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.models import Movie, MovieRatingStats, Review, User, RATING_BUCKETS
+from app.schemas import MovieDetail, MovieResponse, MoviePage, MovieRatingStatsOut, MovieReviewOut, ReviewOut
+from app.database import get_db, get_read_db, get_session_factory
+from app.export import export_response
+from app.pagination import encode_cursor, decode_cursor
+from app.fast_json import FAST_JSON_RESPONSES, ORJSONBody, row_serializer, schema_columns
+from app.conditional import make_etag, validator_headers, is_not_modified, not_modified_response
+from app.cache_fill import get_or_compute
+from app.redis_client import movie_tag, movie_reviews_tag
 
 router = APIRouter()
 
-@router.get("/", response_model=List[MovieResponse])
-def get_movies(
+# Shared caches may hold these briefly; clients revalidate with the ETag
+MOVIE_CACHE_CONTROL = "public, max-age=60"
+MOVIE_LIST_CACHE_CONTROL = "public, max-age=30"
+
+_MOVIE_COLUMNS = schema_columns(MovieResponse, Movie)
+_movie_row = row_serializer(MovieResponse, _MOVIE_COLUMNS)
+
+# GET /movies/{id}?include=...: parts that can be embedded, how many reviews
+# come with the movie, and how long the assembled detail stays cached
+MOVIE_INCLUDES = {"reviews", "stats", "reviewer"}
+MOVIE_DETAIL_REVIEWS = int(os.getenv("MOVIE_DETAIL_REVIEWS", "20"))
+MOVIE_DETAIL_CACHE_TTL = int(os.getenv("MOVIE_DETAIL_CACHE_TTL", "60"))
+MOVIE_DETAIL_NAMESPACE = "movie"
+
+_REVIEW_COLUMNS = schema_columns(ReviewOut, Review)
+
+@router.get("/", response_model=Union[List[MovieResponse], MoviePage])
+async def get_movies(
+    request: Request,
+    response: Response,
     skip: int = 0, 
-    limit: int = 100, 
-    db: Session = Depends(get_db)
+    limit: int = Query(100, ge=1), 
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Fast path selects bare columns and encodes them without per-row validation
+    fast = FAST_JSON_RESPONSES
+    entities = [*_MOVIE_COLUMNS, Movie.updated_at] if fast else [Movie]
+
+    # Legacy offset mode; pass ?cursor= (empty for the first page) for keyset paging.
+    next_cursor = None
+    if cursor is None:
+        query = select(*entities).offset(skip).limit(limit)
+    else:
+        query = select(*entities).order_by(Movie.id).limit(limit + 1)
+        if cursor:
+            (last_id,) = decode_cursor(cursor, int)
+            query = query.where(Movie.id > last_id)
+
+    result = await db.execute(query)
+    movies = result.all() if fast else result.scalars().all()
+    if cursor is not None and len(movies) > limit:
+        movies = movies[:limit]
+        next_cursor = encode_cursor(movies[-1].id)
+
+    # No Last-Modified: a deleted movie would not move the newest updated_at
+    etag = make_etag("movies", cursor is None, next_cursor, [(m.id, m.updated_at) for m in movies])
+    headers = validator_headers(etag, MOVIE_LIST_CACHE_CONTROL)
+    if is_not_modified(request, etag):
+        return not_modified_response(headers)
+
+    if fast:
+        items = [_movie_row(row) for row in movies]
+        return ORJSONBody(items if cursor is None else {"items": items, "next_cursor": next_cursor}, headers=headers)
+    response.headers.update(headers)
+    return movies if cursor is None else {"items": movies, "next_cursor": next_cursor}
+
+@router.get("/export")
+async def export_movies(
+    request: Request,
+    format: str = "ndjson",
+    session_factory = Depends(get_session_factory)
+):
+    query = select(
+        Movie.id, Movie.title, Movie.description, Movie.genre, Movie.release_year, Movie.created_at
+    ).order_by(Movie.id)
+    return export_response(request, session_factory, query, format, "movies")
+
+def _parse_includes(include: str) -> frozenset:
+    includes = {part.strip() for part in include.split(",") if part.strip()}
+    unknown = includes - MOVIE_INCLUDES
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    # Reviewer names only make sense on embedded reviews
+    if "reviewer" in includes:
+        includes.add("reviews")
+    return frozenset(includes)
+
+async def _movie_detail(db, movie_id: int, includes: frozenset) -> dict:
+    """The movie plus what `includes` asks for, in at most two statements.
+
+    Returns {"etag": ..., "body": ...} so a cached detail is revalidated
+    without re-deriving the tag.
+    """
+    row = (await db.execute(
+        select(Movie, MovieRatingStats)
+        .outerjoin(MovieRatingStats, MovieRatingStats.movie_id == Movie.id)
+        .where(Movie.id == movie_id)
+    )).first()
+    if row is None:
+        # Raised rather than returned, so a miss is never cached
+        raise HTTPException(status_code=404, detail="Movie not found")
+    movie, stats = row
+
+    detail = MovieDetail.model_validate(movie)
+    exclude = {"reviews", "reviews_next_cursor"}
+    tag_parts = ["movie-detail", movie.id, movie.updated_at, sorted(includes)]
+
+    if "stats" in includes:
+        detail.rating_stats = (
+            MovieRatingStatsOut.model_validate(stats) if stats
+            else MovieRatingStatsOut(movie_id=movie_id, histogram=[0] * RATING_BUCKETS)
+        )
+        tag_parts.append(stats and (stats.review_count, stats.rating_sum))
+
+    if "reviews" in includes:
+        reviewer = "reviewer" in includes
+        query = (
+            select(*_REVIEW_COLUMNS, Review.updated_at, *([User.username] if reviewer else []))
+            .where(Review.movie_id == movie_id)
+            .order_by(Review.created_at.desc(), Review.id.desc())
+            .limit(MOVIE_DETAIL_REVIEWS + 1)
+        )
+        if reviewer:
+            query = query.outerjoin(User, User.id == Review.user_id)
+        reviews = (await db.execute(query)).all()
+        if len(reviews) > MOVIE_DETAIL_REVIEWS:
+            reviews = reviews[:MOVIE_DETAIL_REVIEWS]
+            detail.reviews_next_cursor = encode_cursor(reviews[-1].created_at, reviews[-1].id)
+        detail.reviews = [MovieReviewOut.model_validate(review) for review in reviews]
+        exclude = set() if reviewer else {"reviews": {"__all__": {"username"}}}
+        tag_parts.append([(review.id, review.updated_at) for review in reviews])
+
+    return {"etag": make_etag(*tag_parts), "body": detail.model_dump(mode="json", exclude=exclude)}
+
+# Both paths are serialized by hand, so the documented schema is the
+# superset: reviews and reviews_next_cursor only appear with ?include=reviews
+@router.get("/{movie_id}", response_model=None, responses={200: {"model": MovieDetail}})
+async def get_movie(
+    movie_id: int,
+    request: Request,
+    response: Response,
+    include_stats: bool = False,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    primary: AsyncSession = Depends(get_db),
 ):
-    movies = db.query(Movie).offset(skip).limit(limit).all()
-    return movies
+    if include is not None:
+        # ?include=reviews,stats,reviewer: one cached unit instead of three calls.
+        # Filled from the primary: a lagging replica's copy would be served to
+        # everyone, the writer included, until the TTL runs out
+        includes = _parse_includes(include) | ({"stats"} if include_stats else set())
+        detail = await get_or_compute(
+            f"{movie_id}:{','.join(sorted(includes))}",
+            lambda: _movie_detail(primary, movie_id, includes),
+            ttl=MOVIE_DETAIL_CACHE_TTL,
+            namespace=MOVIE_DETAIL_NAMESPACE,
+            tags=lambda detail: [movie_tag(movie_id), movie_reviews_tag(movie_id)],
+        )
+        headers = validator_headers(detail["etag"], MOVIE_CACHE_CONTROL)
+        if is_not_modified(request, detail["etag"]):
+            return not_modified_response(headers)
+        return (ORJSONBody if FAST_JSON_RESPONSES else JSONResponse)(detail["body"], headers=headers)
 
-@router.get("/{movie_id}", response_model=MovieResponse)
-def get_movie(movie_id: int, db: Session = Depends(get_db)):
-    movie = db.query(Movie).filter(Movie.id == movie_id).first()
+    options = [selectinload(Movie.rating_stats)] if include_stats else []
+    movie = await db.get(Movie, movie_id, options=options)
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
-    return movie
 
+    if include_stats:
+        # Stats move with every review without touching the movie row, so
+        # they are part of the tag and Last-Modified cannot be offered
+        stats = movie.rating_stats
+        etag = make_etag("movie", movie.id, movie.updated_at, stats and (stats.review_count, stats.rating_sum))
+        headers = validator_headers(etag, MOVIE_CACHE_CONTROL)
+        last_modified = None
+    else:
+        etag = make_etag("movie", movie.id, movie.updated_at)
+        last_modified = movie.updated_at
+        headers = validator_headers(etag, MOVIE_CACHE_CONTROL, last_modified)
+
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+    response.headers.update(headers)
+    return MovieResponse.model_validate(movie)
+
+@router.get("/{movie_id}/stats", response_model=MovieRatingStatsOut)
+async def get_movie_stats(movie_id: int, db: AsyncSession = Depends(get_read_db)):
+    stats = await db.get(MovieRatingStats, movie_id)
+    if stats:
+        return stats
+
+    if not await db.get(Movie, movie_id):
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return MovieRatingStatsOut(movie_id=movie_id, histogram=[0] * RATING_BUCKETS)
@@ -1,128 +1,260 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.models import Review, Movie, User
-from app.schemas import ReviewCreate, ReviewOut, ReviewUpdate
-from app.database import get_db
-from app.dependencies import get_current_user
+from datetime import datetime
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import String, delete, exists, literal, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+import redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Review, Movie
+from app.schemas import ReviewCreate, ReviewIngestStatus, ReviewOut, ReviewPage, ReviewUpdate
+from app.database import get_db, get_read_db, get_session_factory, upsert_insert
+from app.export import export_response
+from app.pagination import encode_cursor, decode_cursor
+from app.rating_stats import apply_rating_change
+from app.dependencies import AuthenticatedUser, get_current_user
+from app.fast_json import FAST_JSON_RESPONSES, ORJSONBody, row_serializer, schema_columns
+from app.redis_client import invalidate_tags, movie_reviews_tag
+from app.review_ingest import REVIEW_WRITE_BEHIND, enqueue_review, get_ingest_status
+from app.conditional import make_etag, validator_headers, is_not_modified, not_modified_response
 
 router = APIRouter()
 
-@router.post("/movies/{movie_id}/reviews", response_model=ReviewOut, status_code=status.HTTP_201_CREATED)
-def create_review(
+REVIEW_LIST_CACHE_CONTROL = "public, max-age=15"
+
+_REVIEW_COLUMNS = schema_columns(ReviewOut, Review)
+_review_row = row_serializer(ReviewOut, _REVIEW_COLUMNS)
+
+
+def _check_rating(rating: float):
+    if rating < 0 or rating > 10:
+        raise HTTPException(
+            status_code=400, 
+            detail="Rating must be between 0 and 10"
+        )
+
+
+async def _not_owned_error(db, review_id: int, action: str) -> HTTPException:
+    """Why an owner-scoped write matched no row: missing (404) or not yours (403)."""
+    owner = await db.scalar(select(Review.user_id).where(Review.id == review_id))
+    if owner is None:
+        return HTTPException(status_code=404, detail="Review not found")
+    return HTTPException(status_code=403, detail=f"You can only {action} your own reviews")
+
+@router.post(
+    "/movies/{movie_id}/reviews",
+    response_model=ReviewOut,
+    status_code=status.HTTP_201_CREATED,
+    responses={202: {"model": ReviewIngestStatus, "description": "Queued for insertion (REVIEW_WRITE_BEHIND)"}},
+)
+async def create_review(
     movie_id: int,
     review_in: ReviewCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None),
 ):
+    _check_rating(review_in.rating)
+
+    if REVIEW_WRITE_BEHIND:
+        queued = await run_in_threadpool(
+            enqueue_review, current_user.id, movie_id, review_in.rating, review_in.comment, idempotency_key
+        )
+        # Without Redis, fall through to the synchronous insert
+        if queued is not None:
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=ReviewIngestStatus(**queued).model_dump(exclude_none=True),
+                headers={"Location": f"/reviews/ingest/{queued['id']}"},
+            )
 
-    movie = db.query(Movie).filter(Movie.id == movie_id).first()
-    if not movie:
+    # One statement: inserts only if the movie exists, and the unique
+    # (movie_id, user_id) index turns a second review into a no-op
+    now = datetime.utcnow()
+    row = select(
+        literal(current_user.id), literal(movie_id), literal(review_in.rating),
+        literal(review_in.comment, String), literal(now), literal(now),
+    ).where(exists().where(Movie.id == movie_id))
+    stmt = (
+        upsert_insert(db, Review.__table__)
+        .from_select(["user_id", "movie_id", "rating", "comment", "created_at", "updated_at"], row)
+        .on_conflict_do_nothing(index_elements=["movie_id", "user_id"])
+        .returning(*_REVIEW_COLUMNS)
+    )
+    try:
+        new_review = (await db.execute(stmt)).first()
+    except IntegrityError:
+        # The movie was deleted between the EXISTS check and the insert
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Movie not found")
 
-    existing_review = db.query(Review).filter(
-        Review.movie_id == movie_id, 
-        Review.user_id == current_user.id
-    ).first()
-    if existing_review:
+    if new_review is None:
+        if await db.scalar(select(Movie.id).where(Movie.id == movie_id)) is None:
+            raise HTTPException(status_code=404, detail="Movie not found")
         raise HTTPException(
             status_code=400, 
             detail="You have already reviewed this movie. Update your existing review instead."
         )
 
-    if review_in.rating < 0 or review_in.rating > 10:
-        raise HTTPException(
-            status_code=400, 
-            detail="Rating must be between 0 and 10"
-        )
-
-    new_review = Review(
-        user_id=current_user.id,
-        movie_id=movie_id,
-        rating=review_in.rating,
-        comment=review_in.comment,
-    )
-    db.add(new_review)
-    db.commit()
-    db.refresh(new_review)
+    await apply_rating_change(db, movie_id, new_rating=review_in.rating)
+    await db.commit()
+    await run_in_threadpool(invalidate_tags, movie_reviews_tag(movie_id))
     return new_review
 
-@router.get("/movies/{movie_id}/reviews", response_model=List[ReviewOut])
-def get_movie_reviews(
+@router.get("/movies/{movie_id}/reviews", response_model=Union[List[ReviewOut], ReviewPage])
+async def get_movie_reviews(
     movie_id: int, 
-    db: Session = Depends(get_db), 
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db), 
     skip: int = 0, 
-    limit: int = 20
+    limit: int = Query(20, ge=1),
+    cursor: Optional[str] = None,
+):
+    # Fast path selects bare columns and encodes them without per-row validation
+    fast = FAST_JSON_RESPONSES
+    entities = [*_REVIEW_COLUMNS, Review.updated_at] if fast else [Review]
+
+    # Legacy offset mode; pass ?cursor= (empty for the first page) for keyset paging.
+    next_cursor = None
+    if cursor is None:
+        query = (
+            select(*entities)
+            .where(Review.movie_id == movie_id)
+            .order_by(Review.created_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+    else:
+        query = (
+            select(*entities)
+            .where(Review.movie_id == movie_id)
+            .order_by(Review.created_at.desc(), Review.id.desc())
+            .limit(limit + 1)
+        )
+        if cursor:
+            last_created, last_id = decode_cursor(cursor, datetime, int)
+            query = query.where(tuple_(Review.created_at, Review.id) < (last_created, last_id))
+
+    result = await db.execute(query)
+    reviews = result.all() if fast else result.scalars().all()
+    # Only an empty page needs to tell "no reviews" from "no such movie"
+    if not reviews and not await db.scalar(select(Movie.id).where(Movie.id == movie_id)):
+        raise HTTPException(status_code=404, detail="Movie not found")
+    if cursor is not None and len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_cursor(reviews[-1].created_at, reviews[-1].id)
+
+    etag = make_etag("reviews", movie_id, cursor is None, next_cursor, [(r.id, r.updated_at) for r in reviews])
+    headers = validator_headers(etag, REVIEW_LIST_CACHE_CONTROL)
+    if is_not_modified(request, etag):
+        return not_modified_response(headers)
+
+    if fast:
+        items = [_review_row(row) for row in reviews]
+        return ORJSONBody(items if cursor is None else {"items": items, "next_cursor": next_cursor}, headers=headers)
+    response.headers.update(headers)
+    return reviews if cursor is None else {"items": reviews, "next_cursor": next_cursor}
+
+@router.get("/movies/{movie_id}/reviews/export")
+async def export_movie_reviews(
+    movie_id: int,
+    request: Request,
+    format: str = "ndjson",
+    db: AsyncSession = Depends(get_read_db),
+    session_factory = Depends(get_session_factory)
 ):
-    movie = db.query(Movie).filter(Movie.id == movie_id).first()
-    if not movie:
+    if not await db.get(Movie, movie_id):
         raise HTTPException(status_code=404, detail="Movie not found")
-    
-    reviews = (
-        db.query(Review)
-        .filter(Review.movie_id == movie_id)
-        .order_by(Review.created_at.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+
+    # Same order as the keyset index, so the cursor walks it without sorting
+    query = (
+        select(Review.id, Review.movie_id, Review.user_id, Review.rating, Review.comment, Review.created_at)
+        .where(Review.movie_id == movie_id)
+        .order_by(Review.created_at.desc(), Review.id.desc())
     )
-    return reviews
+    return export_response(request, session_factory, query, format, f"movie-{movie_id}-reviews")
+
+@router.get("/reviews/ingest/{ingest_id}", response_model=ReviewIngestStatus, response_model_exclude_none=True)
+async def get_review_ingest_status(
+    ingest_id: str,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+):
+    try:
+        queued = await run_in_threadpool(get_ingest_status, ingest_id)
+    except redis.RedisError:
+        raise HTTPException(status_code=503, detail="Review status is temporarily unavailable")
+    # Other users' submissions are indistinguishable from unknown ones
+    if queued is None or queued.get("user_id") != str(current_user.id):
+        raise HTTPException(status_code=404, detail="Review submission not found")
+    return {"id": ingest_id, **queued}
 
 @router.get("/reviews/{review_id}", response_model=ReviewOut)
-def get_review(review_id: int, db: Session = Depends(get_db)):
-    review = db.query(Review).filter(Review.id == review_id).first()
+async def get_review(review_id: int, db: AsyncSession = Depends(get_read_db)):
+    review = await db.get(Review, review_id)
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
     return review
 
 @router.put("/reviews/{review_id}", response_model=ReviewOut)
-def update_review(
+async def update_review(
     review_id: int,
     review_in: ReviewUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
 ):
-    review = db.query(Review).filter(Review.id == review_id).first()
-    if not review:
-        raise HTTPException(status_code=404, detail="Review not found")
-    
-    if review.user_id != current_user.id:
-        raise HTTPException(
-            status_code=403, 
-            detail="You can only update your own reviews"
-        )
-
     if review_in.rating is not None:
-        if review_in.rating < 0 or review_in.rating > 10:
-            raise HTTPException(
-                status_code=400, 
-                detail="Rating must be between 0 and 10"
-            )
-        review.rating = review_in.rating
-    
-    if review_in.comment is not None:
-        review.comment = review_in.comment
+        _check_rating(review_in.rating)
+
+    owned = (Review.id == review_id, Review.user_id == current_user.id)
+    changes = review_in.model_dump(exclude_none=True)
+    if not changes:
+        review = (await db.execute(select(*_REVIEW_COLUMNS).where(*owned))).first()
+        if review is None:
+            raise await _not_owned_error(db, review_id, "update")
+        return review
+
+    old_rating = None
+    if "rating" in changes:
+        # RETURNING only sees the new row, so lock and read the old rating
+        # for the stats delta; a comment-only edit skips this
+        old_rating = await db.scalar(select(Review.rating).where(*owned).with_for_update())
+        if old_rating is None:
+            raise await _not_owned_error(db, review_id, "update")
+
+    stmt = (
+        update(Review.__table__)
+        .where(*owned)
+        .values(**changes, updated_at=datetime.utcnow())
+        .returning(*_REVIEW_COLUMNS)
+    )
+    review = (await db.execute(stmt)).first()
+    if review is None:
+        raise await _not_owned_error(db, review_id, "update")
 
-    db.commit()
-    db.refresh(review)
+    if old_rating is not None:
+        await apply_rating_change(db, review.movie_id, old_rating=old_rating, new_rating=review.rating)
+    await db.commit()
+    await run_in_threadpool(invalidate_tags, movie_reviews_tag(review.movie_id))
     return review
 
 @router.delete("/reviews/{review_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_review(
+async def delete_review(
     review_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_user),
 ):
-    review = db.query(Review).filter(Review.id == review_id).first()
-    if not review:
-        raise HTTPException(status_code=404, detail="Review not found")
-    
-    if review.user_id != current_user.id:
-        raise HTTPException(
-            status_code=403, 
-            detail="You can only delete your own reviews"
-        )
+    stmt = (
+        delete(Review.__table__)
+        .where(Review.id == review_id, Review.user_id == current_user.id)
+        .returning(Review.movie_id, Review.rating)
+    )
+    deleted = (await db.execute(stmt)).first()
+    if deleted is None:
+        raise await _not_owned_error(db, review_id, "delete")
 
-    db.delete(review)
-    db.commit()
+    await apply_rating_change(db, deleted.movie_id, old_rating=deleted.rating)
+    await db.commit()
+    await run_in_threadpool(invalidate_tags, movie_reviews_tag(deleted.movie_id))
     return None
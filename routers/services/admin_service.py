@@ -1,19 +1,22 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
-from app.models import Movie, User
+from fastapi import APIRouter, Depends, Request, status, HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app.models import Movie
 from app.schemas import MovieCreate, MovieResponse
 from app.database import get_db
-from app.dependencies import require_role
-from app.redis_client import clear_search_cache, invalidate_movie_cache
-from sqlalchemy import func
+from app.dependencies import AuthenticatedUser, require_role
+from app.redis_client import clear_search_cache, invalidate_movie_cache, invalidate_tags, movie_tag
+from app.title_index import title_changed, titles_reloaded
+from app.bulk_ingest import bulk_upsert_movies, parse_csv, parse_ndjson
 
 router = APIRouter()
 
 @router.post("/", response_model=MovieResponse, status_code=status.HTTP_201_CREATED)
-def create_movie(
+async def create_movie(
     movie: MovieCreate, 
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(require_role("admin"))
+    db: AsyncSession = Depends(get_db), 
+    current_user: AuthenticatedUser = Depends(require_role("admin"))
 ):
     new_movie = Movie(
         title=movie.title,
@@ -22,56 +25,93 @@ def create_movie(
         release_year=movie.release_year
     )
     db.add(new_movie)
-    db.commit()
-    db.refresh(new_movie)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="A movie with this title already exists")
+    await db.refresh(new_movie)
     
-    clear_search_cache()
+    await run_in_threadpool(clear_search_cache)
+    await run_in_threadpool(title_changed, new_movie.id, new_movie.title)
     
     return new_movie
 
+@router.post("/bulk")
+async def bulk_upsert(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(require_role("admin"))
+):
+    # Body is consumed as a stream, so arbitrarily large catalogs never sit in memory
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        rows = parse_csv(request.stream())
+    elif "ndjson" in content_type or "jsonl" in content_type:
+        rows = parse_ndjson(request.stream())
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send application/x-ndjson or text/csv"
+        )
+
+    upserted = await bulk_upsert_movies(db, rows)
+
+    # One invalidation pass for the whole batch instead of one per movie
+    await run_in_threadpool(invalidate_tags, *(movie_tag(movie_id) for movie_id, _ in upserted))
+    await run_in_threadpool(clear_search_cache)
+    await run_in_threadpool(titles_reloaded)
+
+    return {"upserted": len(upserted)}
+
 @router.put("/{movie_id}", response_model=MovieResponse)
-def update_movie(
+async def update_movie(
     movie_id: int, 
     movie: MovieCreate, 
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_role("admin"))
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(require_role("admin"))
 ):
-    db_movie = db.query(Movie).filter(Movie.id == movie_id).first()
+    db_movie = await db.get(Movie, movie_id)
     if not db_movie:
         raise HTTPException(status_code=404, detail="Movie not found")
 
-    old_title = db_movie.title
+    is_renamed = db_movie.title != movie.title
     
     db_movie.title = movie.title
     db_movie.description = movie.description
     db_movie.genre = movie.genre
     db_movie.release_year = movie.release_year
     
-    db.commit()
-    db.refresh(db_movie)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="A movie with this title already exists")
+    await db.refresh(db_movie)
 
-    invalidate_movie_cache(old_title)
-    if old_title != movie.title:
-        invalidate_movie_cache(movie.title)
+    await run_in_threadpool(invalidate_movie_cache, movie_id)
+    if is_renamed:
+        # The new title may now match queries it never appeared in
+        await run_in_threadpool(clear_search_cache)
+        await run_in_threadpool(title_changed, movie_id, db_movie.title)
     
     return db_movie
 
 @router.delete("/{movie_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_movie(
+async def delete_movie(
     movie_id: int, 
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_role("admin"))
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(require_role("admin"))
 ):
-    movie = db.query(Movie).filter(Movie.id == movie_id).first()
+    movie = await db.get(Movie, movie_id)
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
     
-    movie_title = movie.title
-    
-    db.delete(movie)
-    db.commit()
+    await db.delete(movie)
+    await db.commit()
     
-    invalidate_movie_cache(movie_title)
+    await run_in_threadpool(invalidate_movie_cache, movie_id)
+    await run_in_threadpool(title_changed, movie_id, None)
     
     return None
 
@@ -1,46 +1,103 @@
-
-from typing import List
+import os
+from typing import List, Optional, Union
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import Movie
-from app.schemas import MovieSearchResponse
+from app.schemas import MovieSearchResponse, MovieSearchPage, MovieSuggestion
 from app.database import get_db
-from sqlalchemy import func
-from app.redis_client import get_cached, set_cache
+from app.redis_client import movie_tag
+from app.cache_fill import get_or_compute
+from app.pagination import encode_cursor, decode_cursor
+from app.title_index import title_index, SUGGEST_MAX_RESULTS
+from app.fast_json import FAST_JSON_RESPONSES, ORJSONBody
 
 router = APIRouter()
 
-@router.get("/", response_model=List[MovieSearchResponse])
-def search_movies(db: Session = Depends(get_db), q: str = Query(..., min_length=1)):
-
-    cached = get_cached(q.lower())
-    if cached:
-        return cached
+# Hard cap on how many ranked hits a query ever materializes (and caches)
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "200"))
+SEARCH_MAX_PAGE_SIZE = 100
+# Minimum trigram similarity for fuzzy (typo) matches
+SEARCH_SIMILARITY_THRESHOLD = os.getenv("SEARCH_SIMILARITY_THRESHOLD", "0.2")
 
+def build_search_query(q: str, limit: int = SEARCH_MAX_RESULTS):
     ts_query = func.plainto_tsquery(q)
 
-    results = db.query(
-        Movie,
-        func.coalesce(
-            func.ts_rank_cd(Movie.search_vector, ts_query),
-            func.similarity(Movie.title, q)
-        ).label("score")
-    ).filter(
-        (Movie.search_vector.op('@@')(ts_query)) |
-        (Movie.title.ilike(f"%{q}%")) |
-        (func.similarity(Movie.title, q) > 0.2)
-    ).order_by(
-        func.coalesce(
-            func.ts_rank_cd(Movie.search_vector, ts_query),
-            func.similarity(Movie.title, q)
-        ).desc()
-    ).all()
-
-    if not results:
-        raise HTTPException(status_code=404, detail="No movies found matching")
+    # A single WHERE that ORs these predicates defeats the indexes and scans
+    # every row; as a UNION each branch is served by its own GIN index
+    # (search_vector for FTS, gin_trgm_ops on title for ILIKE and %)
+    candidates = union(
+        select(Movie.id).where(Movie.search_vector.op('@@')(ts_query)),
+        select(Movie.id).where(Movie.title.ilike(f"%{q}%")),
+        select(Movie.id).where(Movie.title.op('%')(q)),
+    ).subquery("candidates")
+
+    score = func.coalesce(
+        func.ts_rank_cd(Movie.search_vector, ts_query),
+        func.similarity(Movie.title, q)
+    ).label("score")
+
+    # Ranking only touches the candidates; ORDER BY ... LIMIT keeps a
+    # bounded top-k heap instead of sorting every match
+    return (
+        select(Movie, score)
+        .join(candidates, candidates.c.id == Movie.id)
+        .order_by(score.desc(), Movie.id)
+        .limit(limit)
+    )
 
-    movies =  [r[0] for r in results]
+@router.get("/suggest", response_model=List[MovieSuggestion])
+async def suggest_titles(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=SUGGEST_MAX_RESULTS),
+):
+    # Served entirely from the in-process index: no DB or Redis round trip
+    return title_index.suggest(prefix, limit)
+
+@router.get("/", response_model=Union[List[MovieSearchResponse], MovieSearchPage])
+async def search_movies(
+    # Only runs on a cache miss and fills the shared cache, so it reads the
+    # primary: a lagging replica's results would outlive its lag by the TTL
+    db: AsyncSession = Depends(get_db),
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+
+    async def run_search():
+        if db.get_bind().dialect.name == "postgresql":
+            # `title % q` compares against this transaction-local threshold
+            await db.execute(
+                select(func.set_config("pg_trgm.similarity_threshold", SEARCH_SIMILARITY_THRESHOLD, True))
+            )
+        result = await db.execute(build_search_query(q))
+        return [
+            MovieSearchResponse.model_validate(movie).model_copy(update={"score": s}).model_dump()
+            for movie, s in result.all()
+        ]
+
+    # Concurrent misses for the same q share one query; empty results are
+    # cached too so nonsense queries cannot stampede either
+    movies = await get_or_compute(
+        q.lower(),
+        run_search,
+        tags=lambda movies: [movie_tag(m["id"]) for m in movies],
+    )
+
+    if not movies:
+        raise HTTPException(status_code=404, detail="No movies found matching")
 
-    set_cache(q.lower(), [MovieSearchResponse.from_orm(m).dict() for m in movies])
+    # Legacy mode returns the first page as a bare list; ?cursor= pages
+    # through the cached top SEARCH_MAX_RESULTS hits
+    if cursor is None:
+        page = movies[:limit]
+        # Cached hits were shaped by MovieSearchResponse when computed
+        return ORJSONBody(page) if FAST_JSON_RESPONSES else page
 
-    return movies
\ No newline at end of file
+    (offset,) = decode_cursor(cursor, int) if cursor else (0,)
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    page = movies[offset:offset + limit]
+    next_cursor = encode_cursor(offset + limit) if offset + limit < len(movies) else None
+    body = {"items": page, "next_cursor": next_cursor}
+    return ORJSONBody(body) if FAST_JSON_RESPONSES else body
@@ -4,6 +4,7 @@ os.environ.setdefault("SECRET_KEY", "testsecret")
 os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
 
+import re
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
@@ -24,28 +25,66 @@ def client():
     TestingSessionLocal = sessionmaker(bind=engine)
     Base.metadata.create_all(bind=engine)
 
-    from app.database import get_db
+    from contextlib import asynccontextmanager
+    from app.database import get_db, get_session_factory, instrument_engine, ThreadedSession
+    instrument_engine(engine)
     try:
         from app.dependencies import get_current_user
     except Exception:
         get_current_user = None
 
-    def override_get_db():
-        db = TestingSessionLocal()
+    async def override_get_db():
+        db = ThreadedSession(TestingSessionLocal())
         try:
             yield db
         finally:
-            db.close()
+            await db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: asynccontextmanager(override_get_db)
 
     if get_current_user is not None:
         def override_get_current_user():
-            return type("User", (), {"id": 1})()
+            return type("User", (), {"id": 1, "role": "admin"})()
         app.dependency_overrides[get_current_user] = override_get_current_user
 
     with TestClient(app) as c:
         yield c
 
     app.dependency_overrides.clear()
-    Base.metadata.drop_all(bind=engine)
\ No newline at end of file
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture()
+def query_count():
+    """SQL statements a response took, read from its Server-Timing header."""
+    def count(response) -> int:
+        match = re.search(r'db;desc="(\d+) queries"', response.headers.get("server-timing", ""))
+        assert match, "response has no db Server-Timing entry"
+        return int(match.group(1))
+    return count
+
+
+@pytest.fixture()
+def fake_redis(monkeypatch):
+    """An empty fakeredis behind app.redis_client, with no live listener.
+
+    The background invalidation listener stays disconnected (its pubsub()
+    fails), so tests drive the local tier and _handle_invalidation directly.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+    from app import redis_client
+
+    fake = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+    def no_pubsub(**kwargs):
+        raise redis.ConnectionError("pubsub disabled in tests")
+
+    monkeypatch.setattr(fake, "pubsub", no_pubsub)
+    monkeypatch.setattr(redis_client, "r", fake)
+    monkeypatch.setattr(redis_client, "_generations", {})
+    redis_client.local_cache.clear()
+    yield fake
+    redis_client._listener_connected.clear()
+    redis_client.local_cache.clear()
@@ -0,0 +1,68 @@
+import json
+import os
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import database
+from app.database import ReplicaSet, instrument_engine
+from app.dependencies import get_current_user
+from app.main import app
+
+# Needs a Postgres database migrated to head (alembic upgrade head) and asyncpg
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL not set")
+
+
+def test_async_db_read_write_and_export(fake_redis, monkeypatch):
+    pytest.importorskip("asyncpg")
+    async_engine = create_async_engine(database._to_async_url(POSTGRES_URL))
+    instrument_engine(async_engine.sync_engine)
+    session_factory = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    sessions = []
+
+    def open_async_session():
+        sessions.append(session_factory())
+        return sessions[-1]
+
+    # What USE_ASYNC_DB=true sets up at import time
+    monkeypatch.setattr(database, "USE_ASYNC_DB", True)
+    monkeypatch.setattr(database, "AsyncSessionLocal", open_async_session)
+    # The same database again as a replica, so reads take its async session
+    replicas = ReplicaSet([POSTGRES_URL])
+    replica = replicas.replicas[0]
+    assert replica.async_session_factory is not None
+    monkeypatch.setattr(database, "replica_set", replicas)
+    monkeypatch.setattr("app.main.replica_set", replicas)
+    app.dependency_overrides[get_current_user] = lambda: type("User", (), {"id": 1, "role": "admin"})()
+
+    title = f"Async {uuid.uuid4().hex}"
+    try:
+        with TestClient(app) as client:
+            r = client.post("/movies/", json={"title": title})
+            assert r.status_code == 201
+            movie_id = r.json()["id"]
+            r = client.put(f"/movies/{movie_id}", json={"title": title, "genre": "Drama"})
+            assert r.json()["genre"] == "Drama"
+
+            r = client.get(f"/movies/{movie_id}")
+            assert (r.json()["title"], r.json()["genre"]) == (title, "Drama")
+            assert replica.async_engine.pool.checkedin() > 0
+
+            # Streams through AsyncSession.stream() in stream_partitions
+            with client.stream("GET", "/movies/export") as r:
+                exported = {json.loads(line)["title"] for line in r.iter_lines() if line}
+            assert title in exported
+
+            assert client.delete(f"/movies/{movie_id}").status_code == 204
+            assert client.get(f"/movies/{movie_id}").status_code == 404
+
+            client.portal.call(async_engine.dispose)
+            client.portal.call(replica.async_engine.dispose)
+    finally:
+        app.dependency_overrides.clear()
+
+    assert sessions and all(isinstance(session, AsyncSession) for session in sessions)
@@ -1,3 +1,6 @@
+import json
+import pytest
+
 
 def test_root_hello(client):
     r = client.get("/")
@@ -78,3 +81,686 @@ def test_reviews_flow(client):
     # After delete
     r = client.get(f"/reviews/{review_id}")
     assert r.status_code == 404
+
+
+def test_movies_cursor_pagination(client):
+    for title in ["A", "B", "C"]:
+        client.post("/movies/", json={"title": title})
+
+    r = client.get("/movies/", params={"cursor": "", "limit": 2})
+    assert r.status_code == 200
+    page = r.json()
+    assert [m["title"] for m in page["items"]] == ["A", "B"]
+    assert page["next_cursor"]
+
+    r = client.get("/movies/", params={"cursor": page["next_cursor"], "limit": 2})
+    page = r.json()
+    assert [m["title"] for m in page["items"]] == ["C"]
+    assert page["next_cursor"] is None
+
+    r = client.get("/movies/", params={"cursor": "not-a-cursor"})
+    assert r.status_code == 400
+
+
+def test_movie_rating_stats(client):
+    r = client.post("/movies/", json={"title": "Little Hearts"})
+    movie_id = r.json()["id"]
+
+    r = client.get(f"/movies/{movie_id}/stats")
+    assert r.status_code == 200
+    assert r.json()["review_count"] == 0
+    assert r.json()["average_rating"] is None
+
+    r = client.post(f"/movies/{movie_id}/reviews", json={"rating": 8.5})
+    review_id = r.json()["id"]
+    r = client.put(f"/reviews/{review_id}", json={"rating": 10})
+
+    stats = client.get(f"/movies/{movie_id}/stats").json()
+    assert stats["review_count"] == 1
+    assert stats["average_rating"] == 10
+    assert stats["histogram"][8] == 0
+    assert stats["histogram"][10] == 1
+
+    r = client.get(f"/movies/{movie_id}", params={"include_stats": True})
+    assert r.json()["rating_stats"]["review_count"] == 1
+
+    client.delete(f"/reviews/{review_id}")
+    stats = client.get(f"/movies/{movie_id}/stats").json()
+    assert stats["review_count"] == 0
+    assert sum(stats["histogram"]) == 0
+
+    r = client.get("/movies/999/stats")
+    assert r.status_code == 404
+
+
+def test_title_suggestions(client):
+    from app.title_index import title_index
+    title_index.load([])
+
+    client.post("/movies/", json={"title": "Baahubali: The Beginning"})
+    r = client.post("/movies/", json={"title": "Baahubali 2: The Conclusion"})
+    movie_id = r.json()["id"]
+    client.post("/movies/", json={"title": "RRR"})
+
+    r = client.get("/search/suggest", params={"prefix": "baah"})
+    assert r.status_code == 200
+    assert {s["title"] for s in r.json()} == {"Baahubali: The Beginning", "Baahubali 2: The Conclusion"}
+
+    client.put(f"/movies/{movie_id}", json={"title": "Kalki"})
+    assert [s["title"] for s in client.get("/search/suggest", params={"prefix": "baah"}).json()] == ["Baahubali: The Beginning"]
+    assert [s["id"] for s in client.get("/search/suggest", params={"prefix": "KAL"}).json()] == [movie_id]
+
+    client.delete(f"/movies/{movie_id}")
+    assert client.get("/search/suggest", params={"prefix": "kal"}).json() == []
+
+
+def test_title_suggestions_rank_broad_prefixes_by_popularity(monkeypatch):
+    from app import title_index as module
+    monkeypatch.setattr(module, "SUGGEST_SCAN_LIMIT", 5)
+    index = module.TitlePrefixIndex()
+    # Eight matches for "the", the most reviewed sorting last
+    rows = [(i, f"The Film {i}", i) for i in range(1, 8)] + [(8, "The Zoo", 100), (9, "Eega", 500)]
+    index.load(rows)
+
+    assert [s["title"] for s in index.suggest("the", 3)] == ["The Zoo", "The Film 7", "The Film 6"]
+    assert [s["title"] for s in index.suggest("t", 2)] == ["The Zoo", "The Film 7"]
+    # Narrow prefixes rank their whole (alphabetical) range
+    assert [s["id"] for s in index.suggest("the film", 2)] == [7, 6]
+
+    index.upsert(8, "A Zoo")
+    assert [s["title"] for s in index.suggest("the", 1)] == ["The Film 7"]
+    assert [s["title"] for s in index.suggest("a", 1)] == ["A Zoo"]
+    index.remove(7)
+    assert [s["id"] for s in index.suggest("the", 2)] == [6, 5]
+
+
+def test_access_token_revoked_by_logout_all(client):
+    from app.dependencies import get_current_user
+    movie_id = client.post("/movies/", json={"title": "Little Hearts"}).json()["id"]
+    client.app.dependency_overrides.pop(get_current_user)
+
+    client.post("/auth/register", json={
+        "username": "prashanth", "email": "prashanth@gmail.com", "password": "pg123"
+    })
+    tokens = client.post("/auth/login", data={"username": "prashanth", "password": "pg123"}).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    r = client.post(f"/movies/{movie_id}/reviews", json={"rating": 8}, headers=headers)
+    assert r.status_code == 201
+    review_id = r.json()["id"]
+
+    # The role claim says "user", so admin routes refuse the token
+    r = client.post("/movies/", json={"title": "RRR"}, headers=headers)
+    assert r.status_code == 403
+    r = client.put("/auth/users/1/role", json={"role": "admin"}, headers=headers)
+    assert r.status_code == 403
+
+    r = client.post("/auth/logout-all", headers=headers)
+    assert r.status_code == 200
+
+    r = client.put(f"/reviews/{review_id}", json={"rating": 9}, headers=headers)
+    assert r.status_code == 401
+
+
+def test_password_hashing_saturation_returns_503(client, monkeypatch):
+    monkeypatch.setattr("app.password_pool.PASSWORD_HASH_MAX_PENDING", 0)
+
+    r = client.post("/auth/register", json={
+        "username": "prashanth", "email": "prashanth@gmail.com", "password": "pg123"
+    })
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+
+
+def test_refresh_token_rotation(client, query_count):
+    client.post("/auth/register", json={
+        "username": "prashanth", "email": "prashanth@gmail.com", "password": "pg123"
+    })
+    tokens = client.post("/auth/login", data={"username": "prashanth", "password": "pg123"}).json()
+
+    r = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert r.status_code == 200
+    # Rotation returns the claims too: no user lookup, no reload after commit
+    assert query_count(r) == 1
+    rotated = r.json()
+    from app.utils import decode_access_token_claims
+    claims = decode_access_token_claims(rotated["access_token"])
+    assert (claims["role"], claims["tv"]) == ("user", 0)
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+
+    # The old token was consumed by the rotation
+    r = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert r.status_code == 401
+
+    r = client.post("/auth/refresh", json={"refresh_token": rotated["refresh_token"]})
+    assert r.status_code == 200
+
+
+def test_bulk_movie_upsert(client):
+    ndjson = (
+        '{"title": "Baahubali", "genre": "Action", "release_year": 2015}\n'
+        '{"title": "Eega", "genre": "Fantasy"}\n'
+        '{"title": "Baahubali", "genre": "Epic", "release_year": 2015}\n'
+    )
+    r = client.post("/movies/bulk", content=ndjson, headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.json() == {"upserted": 2}
+
+    # Same titles again update in place rather than duplicating
+    csv_body = 'title,description,genre,release_year\nEega,"A fly, reborn",Fantasy,2012\nMagadheera,,Action,2009\n'
+    r = client.post("/movies/bulk", content=csv_body, headers={"Content-Type": "text/csv"})
+    assert r.status_code == 200
+
+    movies = {m["title"]: m for m in client.get("/movies/").json()}
+    assert len(movies) == 3
+    assert movies["Baahubali"]["genre"] == "Epic"
+    assert movies["Eega"]["description"] == "A fly, reborn"
+
+    r = client.post("/movies/", json={"title": "Eega"})
+    assert r.status_code == 400
+
+    r = client.post("/movies/bulk", content='{"genre": "Drama"}\n', headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 422
+
+    # A rejected request must not leave its staging table behind
+    r = client.post("/movies/bulk", content='{"title": "RRR"}\n', headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.json() == {"upserted": 1}
+
+    # A multibyte character split across request chunks
+    def split_inside_e_acute(body: str):
+        data = body.encode()
+        cut = data.index("é".encode()) + 1
+        yield data[:cut]
+        yield data[cut:]
+
+    ndjson_type = {"Content-Type": "application/x-ndjson"}
+    r = client.post("/movies/bulk", content=split_inside_e_acute('{"title": "Amélie"}\n'), headers=ndjson_type)
+    assert r.json() == {"upserted": 1}
+    csv_type = {"Content-Type": "text/csv"}
+    r = client.post("/movies/bulk", content=split_inside_e_acute("title,genre\nAmélie,Romance\n"), headers=csv_type)
+    assert r.json() == {"upserted": 1}
+    assert {m["title"]: m["genre"] for m in client.get("/movies/").json()}["Amélie"] == "Romance"
+    r = client.post("/movies/bulk", content=b'{"title": "Am\xe9lie"}\n', headers=ndjson_type)
+    assert r.status_code == 422
+
+
+def test_streaming_exports(client, monkeypatch):
+    monkeypatch.setattr("app.export.EXPORT_BATCH_SIZE", 2)
+    for title in ["Baahubali", "Eega", "Magadheera"]:
+        movie_id = client.post("/movies/", json={"title": title, "genre": "Action"}).json()["id"]
+    client.post(f"/movies/{movie_id}/reviews", json={"rating": 9, "comment": "Epic, truly"})
+
+    r = client.get("/movies/export", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["title"] for row in rows] == ["Baahubali", "Eega", "Magadheera"]
+
+    r = client.get("/movies/export?format=csv")
+    lines = r.text.splitlines()
+    assert lines[0] == "id,title,description,genre,release_year,created_at"
+    assert len(lines) == 4
+
+    r = client.get(f"/movies/{movie_id}/reviews/export?format=csv")
+    assert r.status_code == 200
+    assert '"Epic, truly"' in r.text
+
+    assert client.get("/movies/999/reviews/export").status_code == 404
+    assert client.get("/movies/export?format=xml").status_code == 400
+
+
+def test_fast_json_bodies_match_default_path(client, monkeypatch):
+    movie_id = client.post("/movies/", json={"title": "Baahubali", "genre": "Épico"}).json()["id"]
+    client.post("/movies/", json={"title": "Eega", "release_year": 2012})
+    client.post(f"/movies/{movie_id}/reviews", json={"rating": 9, "comment": "Kattappa ✔"})
+
+    urls = ["/movies/", "/movies/?cursor=&limit=1", f"/movies/{movie_id}/reviews", f"/movies/{movie_id}/reviews?cursor="]
+    default = [client.get(url).content for url in urls]
+
+    monkeypatch.setattr("routers.movies.FAST_JSON_RESPONSES", True)
+    monkeypatch.setattr("routers.reviews.FAST_JSON_RESPONSES", True)
+    assert [client.get(url).content for url in urls] == default
+
+
+def test_query_counts_per_endpoint(client, query_count, monkeypatch, caplog):
+    r = client.post("/movies/", json={"title": "Baahubali"})
+    movie_id = r.json()["id"]
+
+    r = client.get("/movies/")
+    assert query_count(r) == 1
+
+    # conditional insert ... returning, stats upsert
+    r = client.post(f"/movies/{movie_id}/reviews", json={"rating": 9})
+    assert query_count(r) == 2
+
+    r = client.get(f"/movies/{movie_id}/reviews")
+    assert query_count(r) == 1
+
+    r = client.get(f"/movies/{movie_id}?include_stats=true")
+    assert query_count(r) == 2
+
+    # movie joined with stats, then reviews joined with reviewers
+    r = client.get(f"/movies/{movie_id}?include=reviews,stats,reviewer")
+    assert query_count(r) == 2
+
+    monkeypatch.setattr("app.main.QUERY_BUDGET", 0)
+    with caplog.at_level("WARNING", logger="app.main"):
+        client.get("/movies/")
+    assert "over the budget of 0" in caplog.text
+
+
+def test_review_writes_map_misses_to_404_and_403(client, query_count):
+    from app.dependencies import get_current_user
+    movie_id = client.post("/movies/", json={"title": "Baahubali"}).json()["id"]
+
+    assert client.post("/movies/999/reviews", json={"rating": 9}).status_code == 404
+    review_id = client.post(f"/movies/{movie_id}/reviews", json={"rating": 9}).json()["id"]
+
+    r = client.put(f"/reviews/{review_id}", json={"comment": "Still epic"})
+    assert r.status_code == 200
+    assert r.json()["rating"] == 9.0 and r.json()["comment"] == "Still epic"
+    # Comment-only edits need no old rating: just the update
+    assert query_count(r) == 1
+
+    assert client.put("/reviews/999", json={"rating": 5}).status_code == 404
+    assert client.delete("/reviews/999").status_code == 404
+
+    client.app.dependency_overrides[get_current_user] = lambda: type("User", (), {"id": 2, "role": "user"})()
+    assert client.put(f"/reviews/{review_id}", json={"rating": 1}).status_code == 403
+    assert client.delete(f"/reviews/{review_id}").status_code == 403
+    # Another user can still review the same movie
+    assert client.post(f"/movies/{movie_id}/reviews", json={"rating": 7}).status_code == 201
+
+    stats = client.get(f"/movies/{movie_id}/stats").json()
+    assert stats["review_count"] == 2
+    assert stats["average_rating"] == 8.0
+
+
+def test_write_behind_review_ingestion(client, monkeypatch):
+    import asyncio
+    fakeredis = pytest.importorskip("fakeredis")
+    from app import review_ingest
+    from app.database import get_session_factory
+    monkeypatch.setattr(review_ingest, "r", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr("routers.reviews.REVIEW_WRITE_BEHIND", True)
+    review_ingest.ensure_consumer_group()
+    movie_id = client.post("/movies/", json={"title": "Baahubali"}).json()["id"]
+
+    r = client.post(f"/movies/{movie_id}/reviews", json={"rating": 9}, headers={"Idempotency-Key": "k1"})
+    assert r.status_code == 202
+    ingest_id = r.json()["id"]
+    assert r.headers["location"] == f"/reviews/ingest/{ingest_id}"
+    # A retried submission is not queued twice
+    r = client.post(f"/movies/{movie_id}/reviews", json={"rating": 9}, headers={"Idempotency-Key": "k1"})
+    assert r.json()["id"] == ingest_id
+
+    missing = client.post("/movies/999/reviews", json={"rating": 5}).json()["id"]
+    assert client.post(f"/movies/{movie_id}/reviews", json={"rating": 11}).status_code == 400
+    review_ingest.r.xadd(review_ingest.STREAM_KEY, {"id": "garbled", "review": "{"})
+    assert client.get(f"/reviews/ingest/{ingest_id}").json()["state"] == "pending"
+
+    session_factory = client.app.dependency_overrides[get_session_factory]()
+    assert asyncio.run(review_ingest.process_batch(session_factory, block_ms=None)) == 3
+
+    status = client.get(f"/reviews/ingest/{ingest_id}").json()
+    assert status["state"] == "created"
+    assert client.get(f"/reviews/{status['review_id']}").json()["rating"] == 9.0
+    assert client.get(f"/movies/{movie_id}/stats").json()["review_count"] == 1
+    status = client.get(f"/reviews/ingest/{missing}").json()
+    assert (status["state"], status["status_code"]) == ("rejected", 404)
+    assert review_ingest.r.xlen(review_ingest.DEAD_LETTER_KEY) == 1
+    assert review_ingest.r.xlen(review_ingest.STREAM_KEY) == 0
+    assert client.get("/reviews/ingest/unknown").status_code == 404
+
+
+def test_concurrent_idempotent_review_retry_queues_once(fake_redis, monkeypatch):
+    from app import review_ingest
+    monkeypatch.setattr(review_ingest, "r", fake_redis)
+    status_key = review_ingest._status_key
+    retried = []
+
+    def retry_while_first_is_queueing(ingest_id):
+        # A retry with the same key lands after the first submission's claim
+        # but before its status and stream entry are written
+        if not retried:
+            retried.append(None)
+            retried[0] = review_ingest.enqueue_review(1, 1, 8.0, None, "retry-1")
+        return status_key(ingest_id)
+
+    monkeypatch.setattr(review_ingest, "_status_key", retry_while_first_is_queueing)
+    first = review_ingest.enqueue_review(1, 1, 8.0, None, "retry-1")
+
+    assert first["id"] == retried[0]["id"]
+    assert fake_redis.xlen(review_ingest.STREAM_KEY) == 1
+    assert review_ingest.get_ingest_status(first["id"])["state"] == "pending"
+
+
+def test_movie_detail_includes(client, monkeypatch):
+    import asyncio
+    from app.models import User
+    from app.database import get_db
+    from app.dependencies import get_current_user
+    movie_id = client.post("/movies/", json={"title": "Baahubali"}).json()["id"]
+
+    r = client.get(f"/movies/{movie_id}?include=reviews,stats")
+    assert r.json()["reviews"] == []
+    assert r.json()["rating_stats"]["review_count"] == 0
+
+    async def add_user():
+        async for db in client.app.dependency_overrides[get_db]():
+            db.add(User(id=1, username="prashanth", email="p@example.com", password_hash="x"))
+            await db.commit()
+    asyncio.run(add_user())
+    client.post(f"/movies/{movie_id}/reviews", json={"rating": 7})
+    client.app.dependency_overrides[get_current_user] = lambda: type("User", (), {"id": 2, "role": "user"})()
+    client.post(f"/movies/{movie_id}/reviews", json={"rating": 9, "comment": "Epic"})
+    monkeypatch.setattr("routers.movies.MOVIE_DETAIL_REVIEWS", 1)
+
+    r = client.get(f"/movies/{movie_id}?include=reviewer,stats")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["title"] == "Baahubali"
+    assert body["rating_stats"]["average_rating"] == 8.0
+    # Newest first; user 2 has no account row, so no name
+    assert [(rv["rating"], rv["username"]) for rv in body["reviews"]] == [(9.0, None)]
+    page = client.get(f"/movies/{movie_id}/reviews", params={"cursor": body["reviews_next_cursor"]}).json()
+    assert [rv["rating"] for rv in page["items"]] == [7.0]
+
+    r2 = client.get(f"/movies/{movie_id}?include=reviews,stats,reviewer", headers={"If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 304
+
+    body = client.get(f"/movies/{movie_id}?include=reviews").json()
+    assert "username" not in body["reviews"][0] and body["rating_stats"] is None
+    # Without include, the response is unchanged
+    assert "reviews" not in client.get(f"/movies/{movie_id}").json()
+
+    schema = client.get("/openapi.json").json()["paths"]["/movies/{movie_id}"]["get"]["responses"]["200"]
+    assert schema["content"]["application/json"]["schema"]["$ref"].endswith("/MovieDetail")
+
+    assert client.get(f"/movies/{movie_id}?include=cast").status_code == 400
+    assert client.get("/movies/999?include=reviews").status_code == 404
+    assert client.get("/movies/999/reviews").status_code == 404
+
+
+def test_metrics_endpoint(client):
+    client.post("/movies/", json={"title": "Baahubali"})
+    client.get("/movies/1")
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    body = r.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/movies/{movie_id}",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/movies/{movie_id}",status="200",le="+Inf"}' in body
+    assert "http_requests_in_flight 1" in body
+    assert 'password_hash_operations_total{op="hash"}' in body
+    assert "db_queries_total" in body
+
+
+def test_pool_exhaustion_returns_503(client):
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+    from app.database import get_db
+    from app.main import app
+
+    async def exhausted_db():
+        raise PoolTimeoutError("QueuePool limit of size 5 overflow 10 reached")
+        yield
+
+    app.dependency_overrides[get_db] = exhausted_db
+    r = client.get("/movies/")
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+    assert "db_pool_timeouts_total 1" in client.get("/metrics").text
+
+
+def test_reads_use_replica_except_after_own_write(client, tmp_path, monkeypatch):
+    from sqlalchemy import create_engine as create_sync_engine
+    from app.database import ReplicaSet
+    from app.models import Base
+    from app.utils import create_access_token
+
+    # An empty "replica" makes it visible which database served a read
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    Base.metadata.create_all(create_sync_engine(replica_url))
+    replicas = ReplicaSet([replica_url])
+    monkeypatch.setattr("app.database.replica_set", replicas)
+    monkeypatch.setattr("app.main.replica_set", replicas)
+    recent_writers = set()
+    monkeypatch.setattr("app.main.mark_recent_write", recent_writers.add)
+    monkeypatch.setattr("app.main.has_recent_write", lambda user_id: user_id in recent_writers)
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': '1', 'role': 'admin', 'tv': 0})}"}
+    client.post("/movies/", json={"title": "Baahubali"}, headers=headers)
+
+    assert client.get("/movies/").json() == []
+    assert [m["title"] for m in client.get("/movies/", headers=headers).json()] == ["Baahubali"]
+    # Shared cache entries are filled from the primary, never from a replica
+    assert client.get("/movies/1?include=stats").json()["title"] == "Baahubali"
+
+    replica_name = replicas.replicas[0].name
+    assert f'db_pool_checked_out{{database="{replica_name}",engine="sync"}} 0' in client.get("/metrics").text
+
+    # A replica that stops answering is skipped until it recovers
+    replicas.mark_down(replicas.replicas[0], "test")
+    assert len(client.get("/movies/").json()) == 1
+
+
+def test_conditional_get_with_validators(client):
+    movie_id = client.post("/movies/", json={"title": "Baahubali"}).json()["id"]
+
+    r = client.get(f"/movies/{movie_id}")
+    etag, last_modified = r.headers["etag"], r.headers["last-modified"]
+    assert r.headers["cache-control"] == "public, max-age=60"
+
+    r = client.get(f"/movies/{movie_id}", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    r = client.get(f"/movies/{movie_id}", headers={"If-Modified-Since": last_modified})
+    assert r.status_code == 304
+
+    list_etag = client.get("/movies/").headers["etag"]
+    reviews_etag = client.get(f"/movies/{movie_id}/reviews").headers["etag"]
+    assert client.get("/movies/", headers={"If-None-Match": list_etag}).status_code == 304
+
+    client.put(f"/movies/{movie_id}", json={"title": "Baahubali", "genre": "Epic"})
+    client.post(f"/movies/{movie_id}/reviews", json={"rating": 9})
+
+    assert client.get(f"/movies/{movie_id}", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/movies/", headers={"If-None-Match": list_etag}).status_code == 200
+    assert client.get(f"/movies/{movie_id}/reviews", headers={"If-None-Match": reviews_etag}).status_code == 200
+
+
+def test_cache_tags_namespaces_and_local_tier(fake_redis):
+    import json
+    import time
+    from app import redis_client as cache
+    cache.set_cache("rrr", [1], tags=[cache.movie_tag(1)])
+    cache.set_cache("baahubali", [2], tags=[cache.movie_tag(2)])
+
+    # A write to movie 1 drops only the entries tagged with it
+    cache.invalidate_tags(cache.movie_tag(1))
+    assert cache.get_cached("rrr") is None
+    assert cache.get_cached("baahubali") == [2]
+
+    # A bump moves readers to a new generation; old keys just age out
+    old_key = cache._cache_key("baahubali", cache.SEARCH_NAMESPACE)
+    cache.bump_namespace(cache.SEARCH_NAMESPACE)
+    assert cache.get_cached("baahubali") is None
+    assert fake_redis.get(old_key) == json.dumps([2]) and fake_redis.ttl(old_key) > 0
+
+    cache._listener_connected.set()
+    cache.set_cache("eega", [3], ttl=300)
+    key = cache._cache_key("eega", cache.SEARCH_NAMESPACE)
+    # A local copy filled on a Redis hit expires with the Redis key
+    cache.local_cache.clear()
+    fake_redis.pexpire(key, 2000)
+    assert cache.get_cached("eega") == [3]
+    expires_at, _ = cache.local_cache._data[key]
+    assert expires_at - time.monotonic() <= 2
+
+    fake_redis.delete(key)
+    assert cache.get_cached("eega") == [3]
+    # Another worker's write evicts the local entry
+    cache._handle_invalidation({"op": "del", "keys": [key], "sender": "other-worker"})
+    assert cache.get_cached("eega") is None
+
+
+def test_cache_fill_single_flight_lock_timeout_and_early_refresh(fake_redis, monkeypatch):
+    import asyncio
+    import time
+    from app import cache_fill
+    from app.redis_client import acquire_lock, set_cache
+    monkeypatch.setattr(cache_fill, "FILL_LOCK_TTL_MS", 200)
+    monkeypatch.setattr(cache_fill, "FILL_POLL_INTERVAL", 0.01)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def burst():
+        return await asyncio.gather(*(cache_fill.get_or_compute("rrr", compute) for _ in range(5)))
+
+    assert asyncio.run(burst()) == [1] * 5
+    assert len(calls) == 1
+    assert asyncio.run(cache_fill.get_or_compute("rrr", compute)) == 1
+
+    # Another worker holds the fill lock and publishes its result: we use it
+    acquire_lock("fill:search:baahubali", 10_000)
+
+    async def other_worker_fills():
+        await asyncio.sleep(0.05)
+        set_cache("baahubali", {"value": "theirs", "delta": 0.0, "expires_at": time.time() + 300})
+
+    async def wait_for_fill():
+        filler = asyncio.create_task(other_worker_fills())
+        value = await cache_fill.get_or_compute("baahubali", compute)
+        await filler
+        return value
+
+    assert asyncio.run(wait_for_fill()) == "theirs"
+    assert len(calls) == 1
+
+    # The holder never finishes: once the lock TTL passes, the waiter computes
+    acquire_lock("fill:search:eega", 10_000)
+    started = time.monotonic()
+    assert asyncio.run(cache_fill.get_or_compute("eega", compute)) == 2
+    assert time.monotonic() - started >= 0.2
+
+    # A slow-to-compute entry close to expiry is refreshed before it lapses
+    set_cache("magadheera", {"value": "stale", "delta": 10.0, "expires_at": time.time() + 1})
+    monkeypatch.setattr(cache_fill.random, "random", lambda: 0.5)
+    assert asyncio.run(cache_fill.get_or_compute("magadheera", compute)) == 3
+    # ...while one far from expiry is served as is
+    set_cache("pushpa", {"value": "fresh", "delta": 0.01, "expires_at": time.time() + 300})
+    assert asyncio.run(cache_fill.get_or_compute("pushpa", compute)) == "fresh"
+    assert len(calls) == 3
+
+
+def test_token_reaper_deletes_in_batches_under_lock(fake_redis, monkeypatch):
+    import asyncio
+    from datetime import datetime, timedelta
+    from sqlalchemy import create_engine, event, select
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app import token_cleanup
+    from app.models import Base, RefreshToken
+    from app.redis_client import acquire_lock, CACHE_PREFIX
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(token_cleanup, "SessionLocal", session_factory)
+    monkeypatch.setattr(token_cleanup, "TOKEN_CLEANUP_BATCH_SIZE", 3)
+    # Its lock lives 0.9 intervals, so a 1.2s window sees exactly one wake-up
+    monkeypatch.setattr(token_cleanup, "TOKEN_REAPER_INTERVAL_SECONDS", 1)
+
+    now = datetime.utcnow()
+    expired, live_until = now - timedelta(days=1), now + timedelta(days=1)
+    seeds = [(expired, False)] * 7 + [(live_until, True)] * 2 + [(live_until, False)] * 4
+    with session_factory() as db:
+        db.add_all(
+            RefreshToken(user_id=1, token_hash=f"{i:064x}", expires_at=expires_at, revoked=revoked)
+            for i, (expires_at, revoked) in enumerate(seeds)
+        )
+        db.commit()
+        live = [t.id for t in db.scalars(select(RefreshToken).where(RefreshToken.expires_at > now, RefreshToken.revoked == False))]
+    assert token_cleanup.get_token_stats() == {
+        "total_tokens": 13, "active_tokens": 4, "expired_tokens": 7, "revoked_tokens": 2,
+    }
+
+    deletes = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record_deletes(conn, cursor, statement, *args):
+        if statement.startswith("DELETE"):
+            deletes.append(statement)
+
+    async def run_reaper_briefly():
+        reaper = asyncio.create_task(token_cleanup.run_token_reaper())
+        await asyncio.sleep(1.2)
+        reaper.cancel()
+        await asyncio.gather(reaper, return_exceptions=True)
+
+    # Another worker holds the reaper lock for this interval: nothing happens
+    acquire_lock("token-reaper", 10_000)
+    asyncio.run(run_reaper_briefly())
+    assert deletes == [] and token_cleanup.get_token_stats()["total_tokens"] == 13
+
+    fake_redis.delete(f"{CACHE_PREFIX}:lock:token-reaper")
+    asyncio.run(run_reaper_briefly())
+    with session_factory() as db:
+        assert [t.id for t in db.scalars(select(RefreshToken).order_by(RefreshToken.id))] == live
+    # 7 expired rows take three batches of at most 3, the 2 revoked one
+    assert len(deletes) == 4
+    assert token_cleanup.get_token_stats() == {
+        "total_tokens": 4, "active_tokens": 4, "expired_tokens": 0, "revoked_tokens": 0,
+    }
+
+
+def test_search_cursor_paging(client, fake_redis, monkeypatch):
+    from sqlalchemy import select
+    from sqlalchemy.dialects import postgresql
+    from app.models import Movie
+    from routers.services import search_service
+
+    # The real plan: ranked UNION of the FTS, ILIKE and trigram branches,
+    # best score first (id breaks ties) and capped at SEARCH_MAX_RESULTS
+    sql = str(search_service.build_search_query("rrr").compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    ))
+    assert sql.count("UNION") == 2 and "AS score" in sql
+    assert sql.rstrip().endswith(f"ORDER BY score DESC, movies.id \n LIMIT {search_service.SEARCH_MAX_RESULTS}")
+
+    queries = []
+
+    def title_search(q, limit=search_service.SEARCH_MAX_RESULTS):
+        # FTS and trigram similarity are Postgres-only; rank older titles higher
+        queries.append(q)
+        score = (1.0 / Movie.id).label("score")
+        return select(Movie, score).where(Movie.title.ilike(f"%{q}%")).order_by(score.desc(), Movie.id).limit(limit)
+
+    monkeypatch.setattr(search_service, "build_search_query", title_search)
+    ids = [client.post("/movies/", json={"title": f"Movie {i}"}).json()["id"] for i in range(25)]
+
+    seen, scores, sizes, cursor = [], [], [], ""
+    while cursor is not None:
+        r = client.get("/search/", params={"q": "Movie", "limit": 10, "cursor": cursor})
+        assert r.status_code == 200
+        sizes.append(len(r.json()["items"]))
+        seen += [m["id"] for m in r.json()["items"]]
+        scores += [m["score"] for m in r.json()["items"]]
+        cursor = r.json()["next_cursor"]
+    # Every hit exactly once, in rank order
+    assert seen == ids and sizes == [10, 10, 5]
+    assert all(isinstance(score, float) for score in scores)
+    assert scores == sorted(scores, reverse=True) and scores[0] > scores[-1]
+    # All pages were cut from one cached result list
+    assert queries == ["Movie"]
+
+    first = client.get("/search/", params={"q": "movie", "limit": 10}).json()
+    assert [m["id"] for m in first] == ids[:10]
+    assert [m["score"] for m in first] == scores[:10]
+    assert client.get("/search/", params={"q": "movie", "limit": search_service.SEARCH_MAX_PAGE_SIZE + 1}).status_code == 422
+    assert client.get("/search/", params={"q": "unseen"}).status_code == 404
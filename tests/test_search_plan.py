@@ -0,0 +1,27 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from routers.services.search_service import build_search_query
+
+# Needs a Postgres database migrated to head (alembic upgrade head)
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL not set")
+
+
+@pytest.mark.parametrize("q", ["baahubali", "rrr", "bahubali"])
+def test_search_plan_avoids_seq_scan(q):
+    engine = create_engine(POSTGRES_URL)
+    query = build_search_query(q)
+    compiled = query.compile(engine)
+
+    with engine.connect() as conn:
+        # Planner statistics on a small fixture table make seq scans look
+        # cheap; disabling them shows whether an index path exists at all,
+        # which is what a large table needs
+        conn.execute(text("SET enable_seqscan = off"))
+        plan = conn.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).scalars().all()
+
+    assert not any("Seq Scan on movies" in line for line in plan), "\n".join(plan)